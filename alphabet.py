@@ -0,0 +1,130 @@
+"""Byte-level classifier of sequence alphabets."""
+
+DNA = b"ACGTU"
+AMBIGUOUS_DNA = b"RYSWKMBDHVN"
+PROTEIN = b"ABCDEFGHIKLMNPQRSTVWXYZ"
+AMBIGUOUS_PROTEIN = b"BJXZ"
+WHITESPACE = b" \t\r\n"
+
+
+def classify(seq):
+    """
+    Test sequence type.
+
+    Argument:
+    - seq - sequence, required (str or bytes)
+
+    Return the sequence type (DNA, protein or unknown) and its number of
+    ambiguity codes. Sequences made of IUPAC nucleotide codes count as DNA
+    as long as ambiguity codes stay under a tenth of their length.
+    """
+    if isinstance(seq, str):
+        seq = seq.encode("ascii", "replace")
+    seq = seq.upper().translate(None, WHITESPACE)
+    if not seq:
+        return "unknown", 0
+
+    notdna = seq.translate(None, DNA)
+    mostly_dna = len(notdna) * 10 < len(seq)
+    if mostly_dna and not notdna.translate(None, AMBIGUOUS_DNA):
+        return "DNA", len(notdna)
+    if not seq.translate(None, PROTEIN):
+        unambiguous = seq.translate(None, AMBIGUOUS_PROTEIN)
+        return "protein", len(seq) - len(unambiguous)
+
+    return "unknown", 0
+
+
+def parse_fasta(data):
+    """
+    Split fasta text in (name, sequence) records.
+
+    Text without any header is read as a single unnamed sequence. Line
+    breaks and spaces are removed from sequences.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    data = data.strip()
+    if not data.startswith(b">"):
+        if data:
+            yield "", data.translate(None, WHITESPACE)
+        return
+    for block in data[1:].split(b"\n>"):
+        header, _, seq = block.partition(b"\n")
+        name = header.split(None, 1)[0].decode("utf-8") if header else ""
+        yield name, seq.translate(None, WHITESPACE)
+
+
+def classify_records(records):
+    """
+    Classify (name, sequence) records.
+
+    Yield (name, sequence type, number of ambiguity codes) for each record.
+    """
+    for name, seq in records:
+        yield (name,) + classify(seq)
+
+
+def alphabet_report(classified):
+    """
+    Count classified records by type.
+
+    Return a dict with the number of DNA, protein and unknown records, the
+    total of ambiguity codes and the file type, which is DNA or protein when
+    all records agree and unknown otherwise.
+    """
+    report = {"DNA": 0, "protein": 0, "unknown": 0, "ambiguous": 0}
+    for _, stype, ambiguous in classified:
+        report[stype] += 1
+        report["ambiguous"] += ambiguous
+
+    report["type"] = "unknown"
+    if report["DNA"] and not report["protein"] and not report["unknown"]:
+        report["type"] = "DNA"
+    elif report["protein"] and not report["DNA"] and not report["unknown"]:
+        report["type"] = "protein"
+
+    return report
+
+
+class AlphabetCounter(object):
+    """
+    Classify a sequence given in pieces, with the rules of classify.
+
+    Pieces are counted as they come, so records of any length are
+    classified without being held in memory.
+    """
+
+    def __init__(self):
+        self.length = 0
+        self.notdna = 0
+        self.notiupac = 0
+        self.notprotein = 0
+        self.ambiguous = 0
+
+    def update(self, line):
+        """
+        Count residues of a piece of sequence (bytes).
+        """
+        line = line.upper().translate(None, WHITESPACE)
+        notdna = line.translate(None, DNA)
+        self.length += len(line)
+        self.notdna += len(notdna)
+        self.notiupac += len(notdna.translate(None, AMBIGUOUS_DNA))
+        self.notprotein += len(line.translate(None, PROTEIN))
+        self.ambiguous += len(line) - len(
+            line.translate(None, AMBIGUOUS_PROTEIN)
+        )
+
+    def classify(self):
+        """
+        Return the sequence type and its number of ambiguity codes.
+        """
+        if not self.length:
+            return "unknown", 0
+        if self.notdna * 10 < self.length and not self.notiupac:
+            return "DNA", self.notdna
+        if not self.notprotein:
+            return "protein", self.ambiguous
+
+        return "unknown", 0
@@ -1,10 +1,28 @@
-from conodictor import conodictor
+from alphabet import alphabet_report, classify_records, parse_fasta
+from batch import collect_samples, is_archive, is_fasta
+import csv
+from database import db
 from flask import Flask
 from flask import flash, request, render_template, redirect, url_for, session
-from forms import RunForm
+from flask import abort, jsonify, send_file, Response, stream_with_context
+from flask import g
+from forms import jobid_generator, RunForm
+import hashlib
+import itertools
+import json
+import metrics
+from models import Result
 import os
-from rq import Queue
+from progress import job_status
+from reports import PLOT
+from rq import Queue, Retry
+from rq.exceptions import NoSuchJobError
 from rq.job import Job
+from runtime import db_hash, DBDIR
+from scheduler import estimate_job, estimate_text, job_cost, route_job, QUEUES
+import time
+from uploads import records_digest, uploaded, UploadRequest
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 from worker import redis_conn
 
@@ -14,15 +32,19 @@ RESULT_FOLDER = "res"
 
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config.from_object(os.environ["APP_SETTINGS"])
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config["RESULT_FOLDER"] = RESULT_FOLDER
+db.init_app(app)
 
-q = Queue(connection=redis_conn)
+queues = {name: Queue(name, connection=redis_conn) for name in QUEUES}
 
 ALLOWED_EXTENSIONS = {"fa", "fas", "fasta", "fna", "gz"}
-DNA = "ATCG"
-PROTEINS = "ABCDEFGHIKLMNPQRSTVWXYZ"
+FAILED_STATES = {"failed", "stopped", "canceled"}
+DONE_STATES = FAILED_STATES | {"finished"}
+# Results are reused only for the same databases
+DBHASH = db_hash(DBDIR)
 
 
 def allowed_file(filename):
@@ -33,11 +55,270 @@ def allowed_file(filename):
 
 
 def allowed_text(text):
-    return all(i in DNA for i in text.upper()) or all(
-        i in PROTEINS for i in text.upper()
+    report = alphabet_report(classify_records(parse_fasta(text)))
+    return report["type"] in ["DNA", "protein"]
+
+
+def as_fasta(text, name):
+    """Add a header to pasted sequences given without one."""
+    if text.lstrip().startswith(">"):
+        return text
+    return f">{name}\n{text}\n"
+
+
+def job_retry():
+    """
+    Retry policy of conodictor jobs, whose retries resume from checkpoints.
+    """
+    intervals = app.config["JOB_RETRY_INTERVALS"]
+
+    return Retry(max=len(intervals), interval=intervals)
+
+
+def enqueue_job(
+    path, jobname, queue, timeout, func="conodictor.conodictor", meta=None
+):
+    """
+    Queue a conodictor job, then a low priority job building its plot and
+    zip archive once it is done. Jobs are queued by import path, the
+    analysis stack is only loaded by the workers.
+    """
+    outdir = os.path.join(app.config["RESULT_FOLDER"], jobname)
+    job = queues[queue].enqueue(
+        func,
+        args=(path, outdir),
+        kwargs={"resume": True},
+        job_id=jobname,
+        job_timeout=timeout,
+        result_ttl=5000,
+        meta=meta,
+        retry=job_retry(),
+    )
+    queues["low"].enqueue(
+        "reports.build_reports",
+        args=(outdir,),
+        job_id=f"{jobname}-reports",
+        depends_on=job,
+        result_ttl=5000,
+    )
+
+    return job
+
+
+def enqueue_split(path, jobname, queue, timeout, meta=None):
+    """
+    Queue the split job of a distributed run. It queues a scan job per
+    shard, each one with its own timeout, then a reduce job writing the
+    summary, plot and archive.
+    """
+    outdir = os.path.join(app.config["RESULT_FOLDER"], jobname)
+    shard = {
+        "type": "protein",
+        "sequences": 1,
+        "residues": app.config["SHARD_RESIDUES"],
+    }
+    _, shard_timeout = route_job(shard, app.config)
+
+    return queues[queue].enqueue(
+        "distributed.split_job",
+        args=(path, outdir, app.config["SHARD_RESIDUES"], shard_timeout),
+        kwargs={"retry": job_retry()},
+        job_id=jobname,
+        job_timeout=timeout,
+        result_ttl=5000,
+        meta=meta,
+        retry=job_retry(),
+    )
+
+
+def classify_fast(fasta):
+    """
+    Classify a small pasted input on the fast queue and wait for its summary
+    rows. Return None when the job failed or did not finish within
+    FAST_PATH_MAX_WAIT seconds, it is then canceled and the input is to be
+    queued as a regular job.
+    """
+    job = queues["fast"].enqueue(
+        "fastpath.classify_rows",
+        args=(fasta,),
+        job_timeout=app.config["SCHEDULER_BASE_TIMEOUT"],
+        result_ttl=60,
+    )
+    deadline = time.time() + app.config["FAST_PATH_MAX_WAIT"]
+    while time.time() < deadline:
+        state = job.get_status()
+        if state == "finished":
+            return job.result
+        if state in FAILED_STATES:
+            return None
+        time.sleep(app.config["FAST_PATH_POLL_INTERVAL"])
+    job.cancel()
+
+    return None
+
+
+def input_key(digest):
+    """
+    Deduplication key of an input: its records digest and databases. None
+    for inputs without digest, which are never deduplicated.
+    """
+    if digest is None:
+        return None
+    return hashlib.sha256(f"{digest}:{DBHASH}".encode()).hexdigest()
+
+
+def find_origin(key):
+    """
+    Name of a queued, running or finished job with the same input key,
+    None when the input has never been classified successfully.
+    """
+    results = (
+        Result.query.filter_by(input_hash=key)
+        .order_by(Result.id.desc())
+        .limit(10)
+    )
+    for result in results:
+        job = fetch_job(result.origin)
+        if job is not None:
+            if job_status(job)["state"] not in FAILED_STATES:
+                return result.origin
+        elif os.path.exists(
+            os.path.join(
+                app.config["RESULT_FOLDER"], result.origin, "summary.txt"
+            )
+        ):
+            return result.origin
+
+    return None
+
+
+def job_taken(jobname):
+    """
+    Test whether a job name is used by results, by a job queued or running,
+    or by a deduplicated alias.
+    """
+    return (
+        os.path.exists(os.path.join(app.config["RESULT_FOLDER"], jobname))
+        or fetch_job(jobname) is not None
+        or Result.query.filter_by(job_name=jobname).first() is not None
     )
 
 
+def submit_job(path, jobname, key, estimate, pasted=False, meta=None):
+    """
+    Queue a conodictor job, unless an identical input is already queued,
+    running or done, and record it in the results table.
+
+    Return the name of the job whose outputs are served for jobname.
+    """
+    origin = find_origin(key) if key is not None else None
+    if origin is None:
+        queue, timeout = route_job(estimate, app.config, pasted)
+        if job_cost(estimate) > app.config["DISTRIBUTED_RESIDUES"]:
+            enqueue_split(path, jobname, queue, timeout, meta=meta)
+        else:
+            enqueue_job(path, jobname, queue, timeout, meta=meta)
+        request.keep_upload()
+        origin = jobname
+    db.session.add(
+        Result(
+            job_name=jobname,
+            result_url=url_for("results", jobname=jobname),
+            infile=path if origin == jobname else None,
+            input_hash=key,
+            origin=origin,
+        )
+    )
+    db.session.commit()
+
+    return origin
+
+
+def resolve_job(jobname):
+    """Name of the job whose outputs are served for jobname."""
+    result = (
+        Result.query.filter_by(job_name=jobname)
+        .order_by(Result.id.desc())
+        .first()
+    )
+
+    return result.origin if result and result.origin else jobname
+
+
+def fetch_job(jobname):
+    """Return the RQ job of jobname, None once expired or unknown."""
+    try:
+        return Job.fetch(jobname, connection=redis_conn)
+    except NoSuchJobError:
+        return None
+
+
+def read_summary(outdir, limit=None):
+    """Read at most limit rows of a job summary.txt."""
+    with open(os.path.join(outdir, "summary.txt")) as summary:
+        rows = csv.reader(summary, delimiter="\t")
+        next(rows, None)
+        return list(itertools.islice(rows, limit))
+
+
+def wait_status(job, stage, wait):
+    """
+    Long-poll a job status.
+
+    Arguments:
+    - job   - RQ job, required
+    - stage - last stage seen by the client (str)
+    - wait  - maximum number of seconds to wait (float)
+
+    Return the job status as soon as the job is done or its stage is not
+    stage anymore, or after wait seconds.
+    """
+    status = job_status(job)
+    deadline = time.monotonic() + wait
+    while (
+        status["state"] not in DONE_STATES
+        and status["stage"] == stage
+        and time.monotonic() < deadline
+    ):
+        time.sleep(app.config["STATUS_POLL_INTERVAL"])
+        status = job_status(job)
+
+    return status
+
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    """Count requests and their latency by endpoint."""
+    if request.endpoint not in [None, "metrics_page", "static"]:
+        metrics.observe(
+            redis_conn,
+            "conodictor_http_request_seconds",
+            time.perf_counter() - g.start,
+            endpoint=request.endpoint,
+            method=request.method,
+            status=response.status_code,
+        )
+
+    return response
+
+
+@app.teardown_request
+def discard_upload(exc):
+    """Remove uploads of requests that did not start a job."""
+    request.discard_upload()
+
+
+@app.route("/metrics")
+def metrics_page():
+    """Web and worker metrics in the Prometheus text format."""
+    return Response(metrics.render(redis_conn), mimetype="text/plain")
+
+
 @app.route("/")
 def home():
     return render_template("index.html")
@@ -48,9 +329,24 @@ def run():
     form = RunForm()
 
     if request.method == "POST" and form.validate():
-        file = request.files["uploaded_file"]
+        # Files are validated while they are received, see uploads.py
+        try:
+            file = request.files["uploaded_file"]
+        except HTTPException as err:
+            flash(err.description)
+            return redirect(request.url)
         text = request.form["uploaded_text"]
         jobname = request.form["job_id"]
+        # Job names are directory names under RESULT_FOLDER
+        if jobname != secure_filename(jobname):
+            flash(
+                "Job names may only contain letters, digits, dots, dashes"
+                + " and underscores."
+            )
+            return redirect(request.url)
+        if job_taken(jobname):
+            flash(f"Job {jobname} already exists. Please choose another name.")
+            return redirect(request.url)
 
         # If a file is not selected for upload...
         if file.filename == "":
@@ -64,57 +360,56 @@ def run():
                 return redirect(request.url)
             # ...and a sequence is provided and is DNA or proteins
             elif text != "" and allowed_text(text):
-                path = os.path.join(
-                    app.config["UPLOAD_FOLDER"], form.job_id.data
-                )
-                open(
-                    path,
-                    "w",
-                ).write(form.uploaded_text.data)
+                estimate = estimate_text(text)
+                # ...and is small enough to be classified right away
+                if job_cost(estimate) <= app.config["FAST_PATH_RESIDUES"]:
+                    summary = classify_fast(as_fasta(text, jobname))
+                    if summary is not None:
+                        return render_template(
+                            "results.html", jobname=jobname, summary=summary
+                        )
+                fasta = as_fasta(text, jobname)
+                path = os.path.join(request.make_upload_dir(), "pasted.fa")
+                with open(path, "w") as pasted:
+                    pasted.write(fasta)
                 session["jobname"] = jobname
-                job = q.enqueue(
-                    func=conodictor,
-                    args=(
-                        path,
-                        os.path.join(app.config["RESULT_FOLDER"], jobname),
-                    ),
-                    job_id=jobname,
-                    job_timeout=3600,
-                    result_ttl=5000,
-                )
-                return render_template(
-                    "run.html",
-                    form=form,
-                    path=path,
-                    jobname=jobname,
-                    resout=session["resout"],
+                key = input_key(records_digest(parse_fasta(fasta)))
+                submit_job(
+                    path,
+                    jobname,
+                    key,
+                    estimate,
+                    pasted=True,
+                    meta={"input_hash": key},
                 )
+                return redirect(url_for("results", jobname=jobname))
         # If a file is selected for upload...
         elif file.filename != "":
             # ...and the filename is allowed
             if allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-                file.save(path)
+                try:
+                    path, sha256, digest = uploaded(file)
+                except HTTPException as err:
+                    flash(err.description)
+                    return redirect(request.url)
+                # Archives are not checked as they arrive, nor classified
+                if digest is None:
+                    flash(
+                        "Provided file is not supported. Please select"
+                        + " a fasta file either gzipped or not."
+                    )
+                    return redirect(request.url)
 
                 session["jobname"] = jobname
-                job = q.enqueue(
-                    func=conodictor,
-                    args=(
-                        path,
-                        os.path.join(app.config["RESULT_FOLDER"], jobname),
-                    ),
-                    job_id=jobname,
-                    job_timeout=3600,
-                    result_ttl=5000,
-                )
-                return render_template(
-                    "run.html",
-                    form=form,
-                    path=path,
-                    jobname=jobname,
-                    resout=session["resout"],
+                key = input_key(digest)
+                submit_job(
+                    path,
+                    jobname,
+                    key,
+                    estimate_job(path),
+                    meta={"sha256": sha256, "input_hash": key},
                 )
+                return redirect(url_for("results", jobname=jobname))
             # ...and the filename is not allowed
             else:
                 flash(
@@ -126,27 +421,201 @@ def run():
     return render_template("run.html", form=form)
 
 
-@app.route("/results/jobname", methods=["GET", "POST"])
-def results(jobname):
-    if jobname in session:
-        jobid = session["jobid"]
-        job = Job.fetch(jobid, connection=redis_conn)
+@app.route("/batch", methods=["POST"])
+def batch():
+    """
+    Classify many fasta files, or tar and zip archives of them, as a
+    single job. Each file is a sample; per sample summaries are written
+    in the samples folder of the job results.
+    """
+    # Files are streamed to the request upload directory as they arrive
+    try:
+        files = [f for f in request.files.getlist("files") if f.filename]
+        for file in files:
+            if not (is_fasta(file.filename) or is_archive(file.filename)):
+                return (
+                    jsonify(error=f"{file.filename} is not supported."),
+                    400,
+                )
+        paths = [uploaded(file)[0] for file in files]
+    except HTTPException as err:
+        return jsonify(error=err.description), err.code
+    jobname = request.form.get("job_id") or jobid_generator()
+    if not files:
+        return jsonify(error="No file submitted."), 400
+    # Job names are directory names under RESULT_FOLDER
+    if jobname != secure_filename(jobname):
+        return (
+            jsonify(
+                error="Job names may only contain letters, digits, dots,"
+                + " dashes and underscores."
+            ),
+            400,
+        )
+    if job_taken(jobname):
+        return jsonify(error=f"Job {jobname} already exists."), 409
+
+    batchdir = request.upload_dir
+    try:
+        samples = collect_samples(
+            paths,
+            batchdir,
+            app.config["UPLOAD_MAX_SIZE"],
+            app.config["BATCH_MAX_FILES"],
+        )
+    except (ValueError, OSError) as err:
+        return jsonify(error=str(err)), 400
+
+    estimates = [estimate_job(path) for path in samples.values()]
+    stypes = {estimate["type"] for estimate in estimates}
+    if len(stypes) != 1 or "unknown" in stypes:
+        return jsonify(error="Samples must be all DNA or all proteins."), 400
+    estimate = {
+        "sequences": sum(estimate["sequences"] for estimate in estimates),
+        "residues": sum(estimate["residues"] for estimate in estimates),
+        "type": stypes.pop(),
+    }
+    queue, timeout = route_job(estimate, app.config)
+    request.keep_upload()
+    enqueue_job(
+        batchdir, jobname, queue, timeout, func="batch.conodictor_batch"
+    )
+
+    return (
+        jsonify(
+            job=jobname,
+            samples=sorted(samples),
+            status=url_for("status", jobname=jobname),
+            results=url_for("results", jobname=jobname),
+        ),
+        202,
+    )
 
-        if job.is_finished:
-            return redirect(url_for("results", jobid=jobname))
-        else:
-            flash("Your job is not yet finished. Please come back later.")
-            return redirect(url_for("results"))
 
-    else:
+@app.route("/results/<jobname>")
+def results(jobname):
+    """Show job progress, then its predictions once finished."""
+    jobname = secure_filename(jobname)
+    origin = resolve_job(jobname)
+    outdir = os.path.join(app.config["RESULT_FOLDER"], origin)
+    job = fetch_job(origin)
+    status = job_status(job) if job else None
+
+    # Expired jobs are served from their output directory
+    finished = status["state"] == "finished" if status else True
+    if finished and os.path.exists(os.path.join(outdir, "summary.txt")):
+        return render_template(
+            "results.html",
+            jobname=jobname,
+            summary=read_summary(outdir, app.config["RESULTS_MAX_ROWS"]),
+            downloads=True,
+        )
+    if status is None:
         flash(
-            "Your jobid was not found."
+            "Your job was not found."
             + " Please run a job before seeing any result"
         )
-        return render_template(
-            "run.html",
-            jobname=jobname,
+
+    return render_template("results.html", jobname=jobname, status=status)
+
+
+@app.route("/status/<jobname>")
+def status(jobname):
+    """
+    JSON status of a job. With ?wait=seconds, hold the request until the
+    job leaves the stage given by ?stage= or is done.
+    """
+    job = fetch_job(resolve_job(jobname))
+    if job is None:
+        return jsonify(job=jobname, state="unknown"), 404
+
+    wait = min(
+        request.args.get("wait", 0, type=float),
+        app.config["STATUS_MAX_WAIT"],
+    )
+    stage = request.args.get("stage") or None
+    status = wait_status(job, stage, max(wait, 0))
+    if status["state"] == "finished":
+        status["results"] = url_for("results", jobname=jobname)
+
+    return jsonify(status)
+
+
+@app.route("/status/<jobname>/events")
+def status_events(jobname):
+    """
+    Server-sent events with the job status at each change. The stream is
+    closed after STATUS_MAX_WAIT seconds, browsers then reconnect, so that
+    no request holds a web worker thread until the job ends.
+    """
+    job = fetch_job(resolve_job(jobname))
+    if job is None:
+        return jsonify(job=jobname, state="unknown"), 404
+    results_url = url_for("results", jobname=jobname)
+
+    def events():
+        last = None
+        deadline = time.monotonic() + app.config["STATUS_MAX_WAIT"]
+        yield f"retry: {int(app.config['STATUS_POLL_INTERVAL'] * 1000)}\n\n"
+        while True:
+            status = job_status(job)
+            if status["state"] == "finished":
+                status["results"] = results_url
+            if status != last:
+                yield f"data: {json.dumps(status)}\n\n"
+                last = status
+            if status["state"] in DONE_STATES:
+                return
+            if time.monotonic() > deadline:
+                return
+            time.sleep(app.config["STATUS_POLL_INTERVAL"])
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.route("/results/<jobname>/download/<kind>")
+def download(jobname, kind):
+    """
+    Send a job report. Missing plots and archives are built by a low
+    priority job, never in the web process: answer 202 until they are.
+    """
+    origin = resolve_job(secure_filename(jobname))
+    outdir = os.path.join(app.config["RESULT_FOLDER"], origin)
+    if not os.path.exists(os.path.join(outdir, "summary.txt")):
+        abort(404)
+
+    paths = {
+        "summary": os.path.join(outdir, "summary.txt"),
+        "plot": os.path.join(outdir, PLOT),
+        "zip": f"{outdir}.zip",
+    }
+    if kind not in paths:
+        abort(404)
+    if os.path.exists(paths[kind]):
+        return send_file(os.path.abspath(paths[kind]), as_attachment=True)
+    if kind == "plot" and os.path.exists(paths["zip"]):
+        # Reports are built, without a plot when nothing could be plotted
+        abort(404)
+
+    job = fetch_job(f"{origin}-reports")
+    if job is None or job.get_status() in DONE_STATES:
+        job = queues["low"].enqueue(
+            "reports.build_reports",
+            args=(outdir,),
+            job_id=f"{origin}-reports",
+            result_ttl=5000,
         )
+    retry = app.config["REPORTS_RETRY_AFTER"]
+
+    return (
+        jsonify(job=origin, report=kind, state=job.get_status(), retry=retry),
+        202,
+        {"Retry-After": str(retry)},
+    )
 
 
 @app.route("/contact")
@@ -0,0 +1,219 @@
+"""Batch classification of many samples in a single conodictor run."""
+import os
+import pathlib
+import tarfile
+from werkzeug.utils import secure_filename
+import zipfile
+
+
+# Sample names come out of secure_filename and never contain SEP, which
+# already goes through both scanners in the _frame= ids of DNA inputs
+SEP = "="
+FASTA_EXTENSIONS = {".fa", ".fas", ".fasta", ".fna", ".faa"}
+SAMPLES_FOLDER = "samples"
+
+
+def sample_name(filename):
+    """
+    Sample name of a fasta file: its base name without .gz and fasta
+    extensions, made safe for paths.
+    """
+    name = os.path.basename(filename)
+    if name.lower().endswith(".gz"):
+        name = name[:-3]
+    stem, ext = os.path.splitext(name)
+    if ext.lower() in FASTA_EXTENSIONS:
+        name = stem
+
+    return secure_filename(name)
+
+
+def is_fasta(filename):
+    """
+    Test fasta extension of a file name, gzipped or not.
+    """
+    name = filename.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+
+    return os.path.splitext(name)[1] in FASTA_EXTENSIONS
+
+
+def is_archive(filename):
+    """
+    Test tar or zip extension of a file name.
+    """
+    name = filename.lower()
+    return name.endswith((".zip", ".tar", ".tar.gz", ".tgz"))
+
+
+def copy_member(src, dst, limit):
+    """
+    Copy an archive member to dst, raising ValueError once more than limit
+    bytes are written, whatever size the archive declares.
+    """
+    size = 0
+    while True:
+        chunk = src.read(1 << 20)
+        if not chunk:
+            return size
+        size += len(chunk)
+        if limit is not None and size > limit:
+            raise ValueError("Archive content is too large.")
+        dst.write(chunk)
+
+
+def unpack(archive, destdir, max_size=None, max_files=None):
+    """
+    Extract the fasta files of a tar or zip archive.
+
+    Arguments:
+    - archive   - tar, tar.gz or zip file, required (str)
+    - destdir   - directory where files are extracted, required (str)
+    - max_size  - largest number of bytes extracted (int)
+    - max_files - largest number of members in the archive (int)
+
+    Return the paths of extracted files and the bytes written. Directories
+    inside the archive are flattened and other members skipped, so that no
+    path escapes destdir. Raise ValueError past max_size or max_files.
+    """
+    paths = []
+    size = 0
+    if zipfile.is_zipfile(archive):
+        zf = zipfile.ZipFile(archive)
+        members = zf.infolist()
+        if max_files is not None and len(members) > max_files:
+            zf.close()
+            raise ValueError("Archive has too many files.")
+    else:
+        zf = tarfile.open(archive)
+        members = iter(zf)
+    with zf:
+        for count, member in enumerate(members, 1):
+            if max_files is not None and count > max_files:
+                raise ValueError("Archive has too many files.")
+            if isinstance(member, zipfile.ZipInfo):
+                name, isfile = member.filename, not member.is_dir()
+            else:
+                name, isfile = member.name, member.isfile()
+            name = secure_filename(os.path.basename(name))
+            if not isfile or not is_fasta(name):
+                continue
+            path = pathlib.Path(destdir, name)
+            if isinstance(member, zipfile.ZipInfo):
+                src = zf.open(member)
+            else:
+                src = zf.extractfile(member)
+            with src, open(path, "wb") as dst:
+                size += copy_member(
+                    src, dst, max_size - size if max_size is not None else None
+                )
+            paths.append(path)
+
+    return paths, size
+
+
+def collect_samples(paths, destdir, max_size=None, max_files=None):
+    """
+    Map sample names to fasta files, unpacking archives in destdir.
+
+    max_size bounds the bytes extracted from all archives together and
+    max_files the members of each archive. Raise ValueError when two files
+    give the same sample name, when no fasta file is found or past these
+    limits.
+    """
+    samples = {}
+    for path in paths:
+        if is_archive(str(path)):
+            found, size = unpack(path, destdir, max_size, max_files)
+            os.remove(path)
+            if max_size is not None:
+                max_size -= size
+        else:
+            found = [path]
+        for fasta in found:
+            sample = sample_name(str(fasta))
+            if sample in samples:
+                raise ValueError(f"Sample {sample} was given twice.")
+            samples[sample] = fasta
+
+    if not samples:
+        raise ValueError("No fasta file found in batch.")
+
+    return samples
+
+
+def merge_samples(samples, outpath):
+    """
+    Write the records of every sample in one fasta file, each id tagged
+    with its sample name as sample=id.
+
+    Return the number of records per sample.
+    """
+    # The web process checks uploads with this module, the analysis stack
+    # is only loaded by the workers running batches
+    import pyfastx
+
+    counts = {}
+    with open(outpath, "w", buffering=1 << 20) as outfile:
+        for sample, path in samples.items():
+            counts[sample] = 0
+            for name, seq in pyfastx.Fasta(str(path), build_index=False):
+                outfile.write(f">{sample}{SEP}{name}\n{seq}\n")
+                counts[sample] += 1
+
+    return counts
+
+
+def split_summary(outdir, samples):
+    """
+    Split outdir/summary.txt in one summary per sample, without the sample
+    tag, under outdir/samples.
+
+    Return the number of predictions per sample.
+    """
+    sampledir = pathlib.Path(outdir, SAMPLES_FOLDER)
+    sampledir.mkdir(exist_ok=True)
+    counts = dict.fromkeys(samples, 0)
+    outfiles = {}
+    try:
+        with open(pathlib.Path(outdir, "summary.txt")) as summary:
+            header = next(summary)
+            for sample in samples:
+                outfiles[sample] = open(
+                    pathlib.Path(sampledir, f"{sample}.txt"), "w"
+                )
+                outfiles[sample].write(header)
+            for line in summary:
+                sample, _, line = line.partition(SEP)
+                outfiles[sample].write(line)
+                counts[sample] += 1
+    finally:
+        for outfile in outfiles.values():
+            outfile.close()
+
+    return counts
+
+
+def conodictor_batch(batchdir, outdir, **kwargs):
+    """
+    Classify every sample of a batch in a single conodictor run.
+
+    Arguments:
+    - batchdir - directory of uploaded fasta files and archives, required
+    - outdir   - output directory, required (str)
+
+    Other keyword arguments are given to conodictor. The whole batch is
+    merged in batchdir.fa and scanned once, so tool and database fixed
+    costs are paid once, then the summary is split per sample. Return the
+    number of predictions per sample.
+    """
+    from conodictor import conodictor
+
+    paths = sorted(pathlib.Path(batchdir).iterdir())
+    samples = collect_samples(paths, batchdir)
+    inpath = pathlib.Path(f"{batchdir}.fa")
+    merge_samples(samples, inpath)
+    conodictor(inpath, outdir, **kwargs)
+
+    return split_summary(outdir, samples)
@@ -0,0 +1,705 @@
+#!/usr/bin/env python3
+"""Benchmark conodictor stage by stage on synthetic conopeptide datasets.
+
+Datasets of increasing size are generated once in the work directory, as
+DNA and protein fasta files, plain and gzipped. Each one is classified in a
+fresh process so peak memory is its own, with stub hmmsearch and pfscanV3
+unless --real is given. Stage walltimes, throughput and peak RSS are read
+back from the profile.json of each run and compared with a baseline file.
+
+    python benchmark.py --sizes 1000 10000
+    python benchmark.py --save-baseline
+
+With --prefilter, the k-mer prefilter is checked against the full scan of
+the DNA and protein datasets: the share of sequences it keeps, and its
+recall, the share of sequences with hits it keeps. The full scan is
+hmmsearch and pfscanV3, stubs unless --real. Recall below --min-recall
+fails the run, which is how prefilter settings are tuned before turning
+it on with CONODICTOR_PREFILTER set to --min-kmers.
+
+    CONODICTOR_PREFILTER_SCORE=7 python benchmark.py --prefilter --real
+
+With --decision, the family decision, from scan results to summary.txt, is
+timed on --sizes sequence ids against the former functions kept in
+tests/test_decision.py. Any difference between both summaries fails the
+run.
+
+    python benchmark.py --decision --sizes 100000 1000000
+
+With --translation, the six-frame translation of the --sizes DNA datasets
+is timed, in sequences per second, against the former Bio.Seq based
+functions kept in tests/test_translation.py. Any difference between both
+protein files fails the run.
+
+    python benchmark.py --translation --sizes 10000 100000
+
+With --hitparse, a synthetic hmmsearch output of --sizes hit sequences is
+written both as the text report parsed by conodictor 2.1 with Bio.SearchIO
+and as the --tblout table read by search.parse_tblout. Each is parsed in a
+fresh process for its walltime and peak RSS. Any difference between the
+e-values both parsers read fails the run.
+
+    python benchmark.py --hitparse --sizes 100000 1000000
+"""
+import argparse
+from collections import defaultdict
+import gzip
+import json
+import os
+import pathlib
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+BASEDIR = pathlib.Path(os.path.dirname(os.path.realpath(__file__)))
+BASELINE = pathlib.Path(BASEDIR, "benchmark_baseline.json")
+SIZES = [1000, 10000, 100000]
+TYPES = ["DNA", "protein"]
+FAMILIES = "A B1 B2 B4 C D E F G H I1 I2 I3 J K L M N O1 O2 O3 P Q R S T U V"
+# Cysteine frameworks of mature peptides, "-" are random loops
+FRAMEWORKS = ["CC-C-C", "C-C-CC-C-C", "CC-C-C-C-C", "C-C-C-C-C-C-C-C"]
+AMINO = "ADEFGHIKLMNPQRSTVWY"
+CODONS = {
+    "A": ["GCT", "GCC", "GCA", "GCG"],
+    "C": ["TGT", "TGC"],
+    "D": ["GAT", "GAC"],
+    "E": ["GAA", "GAG"],
+    "F": ["TTT", "TTC"],
+    "G": ["GGT", "GGC", "GGA", "GGG"],
+    "H": ["CAT", "CAC"],
+    "I": ["ATT", "ATC", "ATA"],
+    "K": ["AAA", "AAG"],
+    "L": ["TTA", "TTG", "CTT", "CTC", "CTA", "CTG"],
+    "M": ["ATG"],
+    "N": ["AAT", "AAC"],
+    "P": ["CCT", "CCC", "CCA", "CCG"],
+    "Q": ["CAA", "CAG"],
+    "R": ["CGT", "CGC", "CGA", "CGG", "AGA", "AGG"],
+    "S": ["TCT", "TCC", "TCA", "TCG", "AGT", "AGC"],
+    "T": ["ACT", "ACC", "ACA", "ACG"],
+    "V": ["GTT", "GTC", "GTA", "GTG"],
+    "W": ["TGG"],
+    "Y": ["TAT", "TAC"],
+    "*": ["TAA", "TAG", "TGA"],
+}
+
+# Stub tools: cheap deterministic hits on cysteine rich sequences, printed
+# in the formats parsed by search.parse_tblout and search.pssm_scan
+STUB = '''#!{python}
+import sys
+import zlib
+
+families = "{families}".split()
+args = sys.argv[1:]
+if "-h" in args:
+    print("{version}")
+    sys.exit(0)
+inpath = args[args.index("-f") + 1] if "-f" in args else args[-1]
+name = None
+seqs = []
+with open(inpath) as fasta:
+    for line in fasta:
+        if line.startswith(">"):
+            name = line[1:].split(None, 1)[0]
+            seqs.append([name, []])
+        else:
+            seqs[-1][1].append(line.strip())
+out = sys.stdout
+for name, seq in seqs:
+    seq = "".join(seq)
+    if seq.count("C") < 4:
+        continue
+    fam = families[zlib.crc32(seq.encode()) % len(families)]
+    if "{tool}" == "hmmsearch":
+        for part in ["SIG", "PRO", "MAT"]:
+            evalue = (zlib.crc32((part + seq).encode()) % 1000) * 1e-10
+            out.write(
+                f"{{name}} - CONOPEP_{{fam}}_{{part}} - {{evalue:.2e}}"
+                f" 50.0 0.1 - - - - - - - - - - -\\n"
+            )
+    else:
+        out.write(f"CONOPEP_{{fam}}_MAT|{{fam}}\\t1\\t50\\t{{name}}\\t1\\t50\\n")
+'''
+
+# hmmsearch --noali report, see make_hits
+HMMER_HEADER = """\
+# hmmsearch :: search profile(s) against a sequence database
+# HMMER 3.3.2 (Nov 2020); http://hmmer.org/
+# Copyright (C) 2020 Howard Hughes Medical Institute.
+# Freely distributed under the BSD open source license.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# query HMM file:                  conodictor.hmm
+# target sequence database:        proteins.fa
+# show alignments in output:       no
+# sequence reporting threshold:    E-value <= 0.1
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+"""
+HMMER_QUERY = """
+Query:       {name}  [M={length}]
+Scores for complete sequences (score includes all domains):
+   --- full sequence ---   --- best 1 domain ---    -#dom-
+    E-value  score  bias    E-value  score  bias    exp  N  Sequence
+    ------- ------ -----    ------- ------ -----   ---- --  --------
+"""
+HMMER_DOMAINS = """\
+   #    score  bias  c-Evalue  i-Evalue hmmfrom  hmm to    alifrom  ali to\
+    envfrom  env to     acc
+ ---   ------ ----- --------- --------- ------- -------    ------- -------\
+    ------- -------    ----
+   1 !   50.0   0.1   {evalue:>7}   {evalue:>7}       1 {length:>7} []\
+       1 {length:>7} ..       1 {length:>7} .. 0.97
+
+"""
+HMMER_STATS = """
+
+Internal pipeline statistics summary:
+-------------------------------------
+Query model(s):                            1  ({length} nodes)
+Target sequences:                 {size:>10}  (0 residues searched)
+# CPU time: 0.01u 0.00s 00:00:00.01 Elapsed: 00:00:00.01
+# Mc/sec: 100.00
+//
+"""
+
+
+def conopeptide(rng):
+    """
+    Random conopeptide precursor: signal peptide, propeptide and a
+    cysteine framework mature region.
+    """
+    signal = "M" + "".join(rng.choice("LIVAFS") for _ in range(20))
+    pro = "".join(rng.choice(AMINO) for _ in range(rng.randint(10, 40)))
+    mature = "".join(
+        "".join(rng.choice(AMINO) for _ in range(rng.randint(1, 6)))
+        if residue == "-"
+        else residue
+        for residue in rng.choice(FRAMEWORKS)
+    )
+    if rng.random() < 0.3:
+        # Cysteine poor sequence, not a conopeptide
+        mature = "".join(rng.choice(AMINO) for _ in range(len(mature)))
+
+    return signal + pro + mature
+
+
+def back_translate(protein, rng):
+    """
+    Random coding DNA of a protein between untranslated regions.
+    """
+    utr = "".join(rng.choice("ACGT") for _ in range(rng.randint(20, 80)))
+    cds = "".join(rng.choice(CODONS[aa]) for aa in protein + "*")
+
+    return utr + cds + utr[::-1]
+
+
+def make_dataset(workdir, stype, size, compressed, seed=42):
+    """
+    Write a synthetic dataset once and return its path.
+
+    Arguments:
+    - workdir    - directory of datasets, required (str)
+    - stype      - DNA or protein, required (str)
+    - size       - number of sequences, required (int)
+    - compressed - gzip the file (bool)
+    - seed       - random seed, datasets are reproducible (int)
+    """
+    suffix = ".fa.gz" if compressed else ".fa"
+    path = pathlib.Path(workdir, f"{stype}_{size}{suffix}")
+    if path.exists():
+        return path
+
+    rng = random.Random(f"{seed}-{stype}-{size}")
+    opener = gzip.open if compressed else open
+    with opener(path, "wt") as fasta:
+        for idx in range(size):
+            seq = conopeptide(rng)
+            if stype == "DNA":
+                seq = back_translate(seq, rng)
+            fasta.write(f">seq{idx}\n")
+            for start in range(0, len(seq), 60):
+                fasta.write(f"{seq[start:start + 60]}\n")
+
+    return path
+
+
+def make_hits(workdir, size, seed=42):
+    """
+    Write a synthetic hmmsearch output once, as a text report and as a
+    tblout table with the same hits, and return both paths.
+
+    Arguments:
+    - workdir - directory of datasets, required (str)
+    - size    - number of hit sequences, each hit by 1 to 3 queries of the
+                conodictor HMM database, required (int)
+    - seed    - random seed, hits are reproducible (int)
+    """
+    textpath = pathlib.Path(workdir, f"hits_{size}.hmmer")
+    tblpath = pathlib.Path(workdir, f"hits_{size}.tbl")
+    if textpath.exists() and tblpath.exists():
+        return textpath, tblpath
+
+    queries = []
+    with open(pathlib.Path(BASEDIR, "db", "conodictor.hmm")) as hmmfile:
+        for line in hmmfile:
+            if line.startswith("NAME"):
+                name = line.split()[1]
+            elif line.startswith("LENG"):
+                queries.append((name, int(line.split()[1])))
+    rng = random.Random(f"{seed}-hits-{size}")
+    # By query index, CONOPEP_J_PRO is twice in the database
+    hits = [[] for _ in queries]
+    for idx in range(size):
+        seqid = f"seq{idx}_frame={rng.randint(1, 6)}"
+        for query in rng.sample(range(len(queries)), rng.randint(1, 3)):
+            evalue = f"{rng.uniform(1, 9.9):.1f}e-{rng.randint(2, 40):02d}"
+            hits[query].append((seqid, evalue))
+
+    with open(textpath, "w") as text, open(tblpath, "w") as tbl:
+        text.write(HMMER_HEADER)
+        for (name, length), query_hits in zip(queries, hits):
+            text.write(HMMER_QUERY.format(name=name, length=length))
+            for seqid, evalue in query_hits:
+                text.write(
+                    f"    {evalue:>7}   50.0   0.1    {evalue:>7}   50.0"
+                    + f"   0.1    1.0  1  {seqid}\n"
+                )
+                tbl.write(
+                    f"{seqid} - {name} - {evalue} 50.0 0.1 {evalue} 50.0"
+                    + " 0.1 1.0 1 0 0 1 1 1 1 -\n"
+                )
+            text.write("\n\nDomain annotation for each sequence:\n")
+            for seqid, evalue in query_hits:
+                # Two spaces before the description, even when empty
+                text.write(f">> {seqid}  \n")
+                text.write(
+                    HMMER_DOMAINS.format(
+                        seqid=seqid, evalue=evalue, length=length
+                    )
+                )
+            text.write(HMMER_STATS.format(length=length, size=size))
+        text.write("[ok]\n")
+
+    return textpath, tblpath
+
+
+def write_stubs(bindir):
+    """
+    Write stub hmmsearch and pfscanV3 executables in bindir.
+    """
+    for tool, version in [
+        ("hmmsearch", "# HMMER 3.3.2 (Nov 2020)"),
+        ("pfscanV3", "Version 3.2.11"),
+    ]:
+        path = pathlib.Path(bindir, tool)
+        path.write_text(
+            STUB.format(
+                python=sys.executable,
+                families=FAMILIES,
+                version=version,
+                tool=tool,
+            )
+        )
+        path.chmod(0o755)
+
+
+def count_residues(path):
+    """
+    Number of residues of a fasta file, gzipped or not.
+    """
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt") as fasta:
+        return sum(len(line) - 1 for line in fasta if line[0] != ">")
+
+
+def run_case(infile, outdir, workers=None):
+    """
+    Classify infile in outdir, called in the benchmark child process.
+    """
+    from conodictor import conodictor
+
+    conodictor(infile, outdir, force=True, workers=workers, cachedb=None)
+
+
+def benchmark(infile, workdir, env, workers=None):
+    """
+    Run one dataset in a child process and return its measures.
+    """
+    outdir = pathlib.Path(workdir, "out")
+    if outdir.exists():
+        shutil.rmtree(outdir)
+    subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--case",
+            str(infile),
+            str(outdir),
+            "--workers",
+            str(workers or 0),
+        ],
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    with open(pathlib.Path(outdir, "profile.json")) as jsonfile:
+        profile = json.load(jsonfile)
+    residues = count_residues(infile)
+
+    return {
+        "walltime": profile["walltime"],
+        "stages": profile["stages"],
+        "tools": profile["tools"],
+        "residues_per_s": round(residues / max(profile["walltime"], 1e-6)),
+        "peak_rss_mb": round(profile["peak_rss"]["self"] / 2 ** 20, 1),
+        "tool_rss_mb": round(profile["peak_rss"]["children"] / 2 ** 20, 1),
+        "counts": profile["counts"],
+    }
+
+
+def check_prefilter(infile, workdir, min_kmers=2):
+    """
+    Time the prefilter on a dataset and measure its recall against the
+    full scan.
+    """
+    from inputs import read_input
+    from prefilter import load_index, plausible
+    import pyfastx
+    from search import hmm_search, pssm_scan
+    import time
+
+    dbdir = pathlib.Path(BASEDIR, "db")
+    outdir = tempfile.mkdtemp(dir=workdir)
+    _, inpath, seqids = read_input(infile, outdir)
+    records = list(pyfastx.Fasta(str(inpath), build_index=False))
+    table = load_index(str(pathlib.Path(dbdir, "conodictor.hmm")))
+    start = time.perf_counter()
+    passed = plausible([seq for _, seq in records], table, min_kmers)
+    seconds = time.perf_counter() - start
+    kept = {name for (name, _), keep in zip(records, passed) if keep}
+
+    pssmdb = str(pathlib.Path(dbdir, "conodictor.pssm"))
+    hmmdb = str(pathlib.Path(dbdir, "conodictor.hmm"))
+    hits = set(pssm_scan(inpath, pssmdb))
+    hits |= set(hmm_search(inpath, hmmdb, len(seqids)))
+    shutil.rmtree(outdir)
+
+    return {
+        "seconds": round(seconds, 3),
+        "residues_per_s": round(
+            sum(len(seq) for _, seq in records) / seconds
+        ),
+        "kept": round(len(kept) / len(records), 4),
+        "hits": len(hits),
+        "recall": round(len(hits & kept) / len(hits), 4) if hits else 1.0,
+    }
+
+
+def check_decision(size, workdir, seed=0):
+    """
+    Time the family decision of size sequence ids with decision.py and with
+    the former functions.
+    """
+    sys.path.insert(0, str(pathlib.Path(BASEDIR, "tests")))
+    from test_decision import columnar_summary, former_summary, make_results
+    import time
+
+    seqids, hmmdict, pssmdict = make_results(random.Random(seed), size)
+    start = time.perf_counter()
+    former = former_summary(seqids, hmmdict, pssmdict)
+    former_seconds = time.perf_counter() - start
+    path = pathlib.Path(tempfile.mkdtemp(dir=workdir), "summary.txt")
+    start = time.perf_counter()
+    summary = columnar_summary(seqids, hmmdict, pssmdict, False, path)
+    seconds = time.perf_counter() - start
+    shutil.rmtree(path.parent)
+
+    return {
+        "seconds": round(seconds, 3),
+        "former_seconds": round(former_seconds, 3),
+        "identical": summary == former,
+    }
+
+
+def check_translation(infile, workdir):
+    """
+    Time the six-frame translation of a DNA dataset with translation.py and
+    with the former functions.
+    """
+    sys.path.insert(0, str(pathlib.Path(BASEDIR, "tests")))
+    from test_translation import engine_translation, former_do_translation
+    import time
+
+    outdir = tempfile.mkdtemp(dir=workdir)
+    with open(infile) as fasta:
+        nseqs = sum(1 for line in fasta if line[0] == ">")
+    start = time.perf_counter()
+    former_do_translation(infile, pathlib.Path(outdir, "former"))
+    former_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    engine_translation(infile, pathlib.Path(outdir, "engine"))
+    seconds = time.perf_counter() - start
+    with open(pathlib.Path(outdir, "former_proteins.fa"), "rb") as former:
+        with open(pathlib.Path(outdir, "engine_proteins.fa"), "rb") as engine:
+            identical = former.read() == engine.read()
+    shutil.rmtree(outdir)
+
+    return {
+        "seconds": round(seconds, 3),
+        "former_seconds": round(former_seconds, 3),
+        "seqs_per_s": round(nseqs / seconds),
+        "former_seqs_per_s": round(nseqs / former_seconds),
+        "identical": identical,
+    }
+
+
+def peak_rss():
+    """
+    Peak resident memory in bytes of this process. Unlike ru_maxrss, the
+    VmHWM of Linux starts over on exec, without the peak of the benchmark
+    process that made the hits.
+    """
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+
+
+def parse_hits(fmt, path):
+    """
+    Parse a hit file with Bio.SearchIO (hmmer3-text) or parse_tblout
+    (tblout), called in the benchmark child process. Print the walltime,
+    the peak RSS before and after parsing and a digest of the e-values read.
+    """
+    from Bio import SearchIO
+    import hashlib
+    from search import parse_tblout
+    import time
+
+    before = peak_rss()
+    start = time.perf_counter()
+    with open(path) as hitfile:
+        if fmt == "hmmer3-text":
+            hmmdict = defaultdict(lambda: defaultdict(list))
+            for record in SearchIO.parse(hitfile, "hmmer3-text"):
+                for hit in record.hits:
+                    fam = record.id.split("_")[1]
+                    hmmdict[hit.id][fam].append(hit.evalue)
+        else:
+            hmmdict = parse_tblout(hitfile)
+    seconds = time.perf_counter() - start
+    digest = hashlib.sha256(
+        json.dumps(
+            {sid: dict(fams) for sid, fams in hmmdict.items()}, sort_keys=True
+        ).encode("utf-8")
+    ).hexdigest()
+    print(
+        json.dumps(
+            {
+                "seconds": seconds,
+                "import_rss": before,
+                "peak_rss": peak_rss(),
+                "digest": digest,
+            }
+        )
+    )
+
+
+def check_hitparse(size, workdir):
+    """
+    Parse size synthetic hits with Bio.SearchIO and with parse_tblout, each
+    in a fresh process.
+    """
+    res = {}
+    for fmt, path in zip(["hmmer3-text", "tblout"], make_hits(workdir, size)):
+        run = subprocess.run(
+            [sys.executable, __file__, "--parse-case", fmt, str(path)],
+            check=True,
+            capture_output=True,
+        )
+        res[fmt] = json.loads(run.stdout)
+        res[fmt]["mb"] = round(os.path.getsize(path) / 2 ** 20, 1)
+
+    return {
+        "seconds": round(res["tblout"]["seconds"], 3),
+        "former_seconds": round(res["hmmer3-text"]["seconds"], 3),
+        "peak_rss_mb": round(res["tblout"]["peak_rss"] / 2 ** 20, 1),
+        "former_peak_rss_mb": round(
+            res["hmmer3-text"]["peak_rss"] / 2 ** 20, 1
+        ),
+        "import_rss_mb": round(res["tblout"]["import_rss"] / 2 ** 20, 1),
+        "file_mb": res["tblout"]["mb"],
+        "former_file_mb": res["hmmer3-text"]["mb"],
+        "identical": res["tblout"]["digest"] == res["hmmer3-text"]["digest"],
+    }
+
+
+def regressions(results, baseline, tolerance, floor=0.05):
+    """
+    List measures slower than the baseline by more than tolerance (ratio)
+    and floor (seconds).
+    """
+    found = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        base = baseline[case]
+        pairs = [("walltime", result["walltime"], base["walltime"])]
+        pairs += [
+            (stage, sec, base["stages"].get(stage))
+            for stage, sec in result["stages"].items()
+        ]
+        for name, new, old in pairs:
+            if old is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > floor:
+                found.append(f"{case} {name}: {old:.3f}s -> {new:.3f}s")
+
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--types", nargs="+", default=TYPES, choices=TYPES)
+    parser.add_argument("--workdir", help="dataset directory, kept")
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument(
+        "--real", action="store_true", help="use hmmsearch and pfscanV3"
+    )
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument(
+        "--prefilter", action="store_true", help="check the prefilter recall"
+    )
+    parser.add_argument(
+        "--decision", action="store_true", help="check the decision engine"
+    )
+    parser.add_argument(
+        "--translation", action="store_true", help="check the translation"
+    )
+    parser.add_argument(
+        "--hitparse", action="store_true", help="check the hits parsing"
+    )
+    parser.add_argument("--min-kmers", type=int, default=2)
+    parser.add_argument("--min-recall", type=float, default=0.99)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--case", nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument("--parse-case", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(*args.case, workers=args.workers or None)
+        return 0
+    if args.parse_case:
+        parse_hits(*args.parse_case)
+        return 0
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="conodictor-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    env = dict(os.environ)
+    if not args.real:
+        bindir = pathlib.Path(workdir, "bin")
+        bindir.mkdir(exist_ok=True)
+        write_stubs(bindir)
+        env["PATH"] = f"{bindir}{os.pathsep}{env.get('PATH', '')}"
+        # The prefilter check runs the tools from this process
+        os.environ["PATH"] = env["PATH"]
+
+    results = {}
+    if args.decision:
+        for size in args.sizes:
+            res = results[f"decision-{size}"] = check_decision(size, workdir)
+            print(
+                f"decision-{size:<11} {res['seconds']:8.3f}s,"
+                + f" former {res['former_seconds']:.3f}s,"
+                + f" {'identical' if res['identical'] else 'DIFFERENT'}"
+            )
+
+        return 0 if all(res["identical"] for res in results.values()) else 1
+
+    if args.translation:
+        for size in args.sizes:
+            infile = make_dataset(workdir, "DNA", size, False)
+            res = results[f"translation-{size}"] = check_translation(
+                infile, workdir
+            )
+            print(
+                f"translation-{size:<8} {res['seqs_per_s']:>10} seq/s,"
+                + f" former {res['former_seqs_per_s']} seq/s,"
+                + f" {'identical' if res['identical'] else 'DIFFERENT'}"
+            )
+
+        return 0 if all(res["identical"] for res in results.values()) else 1
+
+    if args.hitparse:
+        for size in args.sizes:
+            res = results[f"hitparse-{size}"] = check_hitparse(size, workdir)
+            print(
+                f"hitparse-{size:<11} {res['seconds']:8.3f}s"
+                + f" {res['peak_rss_mb']:7.1f} MB,"
+                + f" former {res['former_seconds']:.3f}s"
+                + f" {res['former_peak_rss_mb']:.1f} MB,"
+                + f" imports {res['import_rss_mb']:.1f} MB,"
+                + f" {'identical' if res['identical'] else 'DIFFERENT'}"
+            )
+
+        return 0 if all(res["identical"] for res in results.values()) else 1
+
+    if args.prefilter:
+        for stype in args.types:
+            for size in args.sizes:
+                infile = make_dataset(workdir, stype, size, False)
+                res = results[f"{stype}-{size}"] = check_prefilter(
+                    infile, workdir, args.min_kmers
+                )
+                print(
+                    f"{stype}-{size:<12} {res['seconds']:8.3f}s"
+                    + f" {res['residues_per_s']:>10} res/s"
+                    + f" kept {res['kept']:.2%},"
+                    + f" recall {res['recall']:.2%} of {res['hits']} hits"
+                )
+        recall = min(res["recall"] for res in results.values())
+
+        return 1 if recall < args.min_recall else 0
+
+    for stype in args.types:
+        for size in args.sizes:
+            for compressed in [False, True]:
+                case = f"{stype}-{size}{'-gz' if compressed else ''}"
+                infile = make_dataset(workdir, stype, size, compressed)
+                results[case] = benchmark(infile, workdir, env, args.workers)
+                res = results[case]
+                stages = " ".join(
+                    f"{name}={sec:.3f}" for name, sec in res["stages"].items()
+                )
+                print(
+                    f"{case:<20} {res['walltime']:8.3f}s"
+                    + f" {res['residues_per_s']:>10} res/s"
+                    + f" {res['peak_rss_mb']:7.1f} MB  {stages}"
+                )
+
+    if args.output:
+        with open(args.output, "w") as jsonfile:
+            json.dump(results, jsonfile, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as jsonfile:
+            json.dump(results, jsonfile, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as jsonfile:
+        found = regressions(results, json.load(jsonfile), args.tolerance)
+    for line in found:
+        print(f"REGRESSION {line}")
+
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""Persistent cache of per-sequence HMM and PSSM results."""
+from collections import defaultdict
+import hashlib
+import json
+import os
+import pathlib
+import pyfastx
+from runtime import db_hash
+from search import parallel_scan
+import sqlite3
+import time
+
+
+DEFAULT_CACHE = os.getenv(
+    "CONODICTOR_CACHE",
+    str(pathlib.Path(os.path.dirname(os.path.realpath(__file__)), "cache.db")),
+)
+MAX_ENTRIES = int(os.getenv("CONODICTOR_CACHE_SIZE", "1000000"))
+# hmmsearch e-value threshold used by the HMM stage
+HMM_EVALUE = 0.1
+# Layout of the results table, older tables are dropped on open
+SCHEMA_VERSION = 1
+
+
+class ResultCache(object):
+    """
+    SQLite store of HMM e-values and PSSM families by protein sequence.
+
+    HMM e-values are stored as hmmsearch reported them, with the number of
+    sequences of the job that computed them. They are read back unchanged
+    by jobs of the same size, so exact ties of the family decision hold,
+    and rescaled to the size of other jobs. Entries are evicted least
+    recently used first once max_entries is reached.
+    """
+
+    def __init__(self, path, dbhash, max_entries=MAX_ENTRIES):
+        self.dbhash = dbhash
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(str(path), timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # Entries of version 0 hold e-values divided by nseqs
+            self.conn.execute("DROP TABLE IF EXISTS results")
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY,"
+            + " nseqs INTEGER, hmm TEXT, pssm TEXT, last_used REAL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_last_used"
+            + " ON results (last_used)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS stats"
+            + " (name TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self.conn.commit()
+
+    def key(self, seq):
+        """
+        Content key of a protein sequence for the current databases.
+        """
+        return hashlib.sha256(
+            f"{self.dbhash}:{seq.upper()}".encode("ascii")
+        ).hexdigest()
+
+    def get(self, keys, nseqs):
+        """
+        Fetch cached results usable for a job of nseqs sequences.
+
+        Return a dict of (hmm e-values by family, pssm families) by key.
+        Entries computed on larger jobs are skipped since they may miss
+        hits that pass the e-value threshold of a smaller job.
+        """
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]  # noqa: E203
+            rows = self.conn.execute(
+                "SELECT key, nseqs, hmm, pssm FROM results WHERE nseqs <= ?"
+                + f" AND key IN ({','.join('?' * len(batch))})",
+                [nseqs] + batch,
+            )
+            for key, stored_nseqs, hmm, pssm in rows:
+                evalues = json.loads(hmm)
+                if stored_nseqs != nseqs:
+                    evalues = {
+                        fam: [e * nseqs / stored_nseqs for e in ev]
+                        for fam, ev in evalues.items()
+                    }
+                evalues = {
+                    fam: [e for e in ev if e <= HMM_EVALUE]
+                    for fam, ev in evalues.items()
+                }
+                found[key] = (
+                    {fam: ev for fam, ev in evalues.items() if ev},
+                    json.loads(pssm),
+                )
+
+        self.conn.executemany(
+            "UPDATE results SET last_used = ? WHERE key = ?",
+            [(time.time(), key) for key in found],
+        )
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        self.conn.commit()
+
+        return found
+
+    def put(self, results, nseqs):
+        """
+        Store (hmm e-values by family, pssm families) by key for a job of
+        nseqs sequences, then evict least recently used entries.
+        """
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    key,
+                    nseqs,
+                    json.dumps(hmm),
+                    json.dumps(pssm),
+                    now,
+                )
+                for key, (hmm, pssm) in results.items()
+            ],
+        )
+        excess = (
+            self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            - self.max_entries
+        )
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results"
+                + " ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+        self.conn.commit()
+
+    def close(self):
+        """
+        Add this session hit and miss counts to the stored counters.
+        """
+        for name, value in [("hits", self.hits), ("misses", self.misses)]:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO stats VALUES (?, 0)", (name,)
+            )
+            self.conn.execute(
+                "UPDATE stats SET value = value + ? WHERE name = ?",
+                (value, name),
+            )
+        self.conn.commit()
+        self.conn.close()
+
+    def stats(self):
+        """
+        Return the stored hit and miss counters.
+        """
+        return dict(self.conn.execute("SELECT name, value FROM stats"))
+
+
+def cached_scan(
+    inpath,
+    dbdir,
+    outdir,
+    nseqs,
+    cachedb,
+    workers=None,
+    keep_raw=False,
+    dbhash=None,
+    timings=None,
+    done=None,
+):
+    """
+    Run HMM and PSSM scans only on sequences missing from the cache.
+
+    Arguments:
+    - inpath   - protein fasta file, required (str)
+    - dbdir    - directory of conodictor.hmm and conodictor.pssm, required
+    - outdir   - job output directory, required (str)
+    - nseqs    - number of sequences in inpath, required (int)
+    - cachedb  - path of the cache database, required (str)
+    - workers  - number of concurrent tool runs (int)
+    - keep_raw - keep tools outputs in outdir (bool)
+    - dbhash   - hash of the databases, computed from dbdir if not given
+    - timings  - dict of tool walltimes, see search.parallel_scan
+    - done     - function called with the scan name and its results, cached
+                 ones included, see search.parallel_scan
+
+    Return hmmdict, pssmdict and the cache hit and miss counts.
+    """
+    cache = ResultCache(cachedb, dbhash or db_hash(dbdir))
+    hmmdict = defaultdict(lambda: defaultdict(list))
+    pssmdict = defaultdict(list)
+
+    keys = {}
+    for name, seq in pyfastx.Fasta(str(inpath), build_index=False):
+        keys[name] = cache.key(seq)
+    found = cache.get(set(keys.values()), nseqs)
+
+    missing = {}
+    misspath = pathlib.Path(outdir, "uncached.fa")
+    # An index left by an interrupted run would not match the new file
+    if os.path.exists(f"{misspath}.fxi"):
+        os.remove(f"{misspath}.fxi")
+    if not found:
+        # Nothing to leave out, the input is scanned as is
+        missing, scanpath = keys, inpath
+    else:
+        scanpath = misspath
+        with open(misspath, "w") as missfile:
+            for name, seq in pyfastx.Fasta(str(inpath), build_index=False):
+                key = keys[name]
+                if key in found:
+                    hmm, pssm = found[key]
+                    for fam, evalues in hmm.items():
+                        hmmdict[name][fam].extend(evalues)
+                    if pssm:
+                        pssmdict[name].extend(pssm)
+                else:
+                    missing[name] = key
+                    missfile.write(f">{name}\n{seq}\n")
+
+    def merged(name, results):
+        # Cached and missing sequences are disjoint
+        if done:
+            done(name, {**(hmmdict if name == "hmm" else pssmdict), **results})
+
+    # Removed on failures too, not to be found by a retry of the run
+    try:
+        if missing:
+            fresh_hmm, fresh_pssm = parallel_scan(
+                scanpath,
+                dbdir,
+                outdir,
+                nseqs,
+                workers,
+                keep_raw,
+                timings,
+                done=merged,
+            )
+            fresh = {}
+            for name, key in missing.items():
+                hmm = dict(fresh_hmm.get(name, {}))
+                pssm = fresh_pssm.get(name, [])
+                fresh[key] = (hmm, pssm)
+                for fam, evalues in hmm.items():
+                    hmmdict[name][fam].extend(evalues)
+                if pssm:
+                    pssmdict[name].extend(pssm)
+            # Reached only when both scans exited cleanly: parallel_scan
+            # raises on tool failures, whose empty results are never stored
+            cache.put(fresh, nseqs)
+        elif done:
+            done("hmm", hmmdict)
+            done("pssm", pssmdict)
+        hits, misses = cache.hits, cache.misses
+    finally:
+        if scanpath == misspath:
+            os.remove(misspath)
+        if os.path.exists(f"{misspath}.fxi"):
+            os.remove(f"{misspath}.fxi")
+        cache.close()
+
+    return hmmdict, pssmdict, hits, misses
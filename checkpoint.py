@@ -0,0 +1,98 @@
+"""Stage checkpoints of a conodictor run, so that a retried job resumes."""
+import hashlib
+import json
+import os
+import pathlib
+
+
+MANIFEST = "manifest.json"
+CHECKPOINTS_FOLDER = "checkpoints"
+
+
+def stage_key(*inputs):
+    """
+    sha256 of the inputs of a stage: file checksums, settings and keys of
+    the stages it depends on.
+    """
+    return hashlib.sha256(
+        json.dumps([str(value) for value in inputs]).encode("utf-8")
+    ).hexdigest()
+
+
+class Manifest(object):
+    """
+    Completed stages of a run, listed in outdir/checkpoints/manifest.json.
+
+    Each stage is recorded with the key of its inputs, the files it wrote
+    and its result, kept as JSON next to the manifest. A stage is done
+    when recorded with the same key and all its files are still there.
+    The manifest also names the owner of the directory, the RQ job that
+    created it, as only this job may reuse or reset it.
+    """
+
+    def __init__(self, outdir):
+        self.outdir = pathlib.Path(outdir)
+        self.path = pathlib.Path(outdir, CHECKPOINTS_FOLDER, MANIFEST)
+        self.owner = None
+        self.stages = {}
+        if self.path.exists():
+            with open(self.path) as manifest:
+                data = json.load(manifest)
+            self.owner = data["owner"]
+            self.stages = data["stages"]
+
+    def claim(self, owner):
+        """
+        Record owner as the owner of the directory, before any stage.
+        """
+        self.owner = owner
+        self._save()
+
+    def result_path(self, stage):
+        return pathlib.Path(self.outdir, CHECKPOINTS_FOLDER, f"{stage}.json")
+
+    def load(self, stage, key):
+        """
+        Result of stage when done with the same key, None otherwise.
+        """
+        entry = self.stages.get(stage)
+        if entry is None or entry["key"] != key:
+            return None
+        files = entry["files"] + [str(self.result_path(stage))]
+        if not all(os.path.exists(path) for path in files):
+            return None
+        with open(self.result_path(stage)) as jsonfile:
+            return json.load(jsonfile)
+
+    def save(self, stage, key, result, files=()):
+        """
+        Record stage as done with key, its JSON friendly result and the
+        files it wrote.
+        """
+        self._write(self.result_path(stage), result)
+        self.stages[stage] = {
+            "key": key,
+            "files": [str(path) for path in files if path],
+        }
+        self._save()
+
+    def drop(self, *stages):
+        """
+        Forget stages and remove their results.
+        """
+        for stage in stages:
+            self.stages.pop(stage, None)
+            if self.result_path(stage).exists():
+                os.remove(self.result_path(stage))
+        self._save()
+
+    def _save(self):
+        self._write(self.path, {"owner": self.owner, "stages": self.stages})
+
+    def _write(self, path, data):
+        # Written aside then renamed, a killed job never leaves half a file
+        os.makedirs(path.parent, exist_ok=True)
+        tmppath = pathlib.Path(path.parent, f".{path.name}.{os.getpid()}")
+        with open(tmppath, "w") as jsonfile:
+            json.dump(data, jsonfile)
+        os.replace(tmppath, path)
@@ -1,285 +1,69 @@
 #!/usr/bin/env python3
 
-from Bio import SearchIO
-from Bio.Seq import reverse_complement, translate
-from collections import Counter, defaultdict
-import csv
+from cache import cached_scan, DEFAULT_CACHE
+from checkpoint import Manifest, stage_key
 from datetime import datetime
-from functools import reduce
-import gzip
-from heapq import nsmallest
-from matplotlib import pyplot as plt
-import numpy as np
-from operator import mul
+from decision import hmm_families, pssm_families, summarize, write_summary
+from inputs import read_input
 import os
 import logging
-import pandas as pd
+from metrics import record_profile
 import pathlib
+from prefilter import AUDIT, KMER_SCORE, MIN_KMERS, prefilter_fasta
+from profiling import Profile
 import pyfastx
-import re
+from reports import build_reports
+from rq import get_current_job
+from runtime import checksum, get_context
+from search import dedup_fasta, fan_out, parallel_scan
 import shutil
-import subprocess
 import sys
-import warnings
-
-
-def conodictor(infile, outdir, force=False, allres=False):
-
-    # Functions -------------------------------------------------------------
-    def donut_graph():
-        """
-        Make a donut graph from stats of predicted sequences.
-        """
-        data = pd.read_table(pathlib.Path(outdir, "summary.txt"))
-        plot_data = data[data.columns[3]].tolist()
-        dtc = Counter(plot_data)
-        labels = [
-            f"{k1}: {v1}"
-            for k1, v1 in dtc.items()
-            if not k1.startswith("CONFLICT")
-        ]
-        values = [x for k2, x in dtc.items() if not k2.startswith("CONFLICT")]
-
-        # White circle
-        _, ax = plt.subplots(figsize=(8, 5), subplot_kw=dict(aspect="equal"))
-        wedges, _ = ax.pie(
-            np.array(values).ravel(),
-            wedgeprops=dict(width=0.5),
-            startangle=-40,
-        )
+from translation import MIN_ORF
 
-        bbox_props = dict(
-            boxstyle="square,pad = 0.3", fc="w", ec="k", lw=0.72
-        )
 
-        kw = dict(
-            arrowprops=dict(arrowstyle="-"),
-            bbox=bbox_props,
-            zorder=0,
-            va="center",
-        )
+VERSION = "2.1.3"
 
-        for i, p in enumerate(wedges):
-            ang = (p.theta2 - p.theta1) / 2.0 + p.theta1
-            y = np.sin(np.deg2rad(ang))
-            x = np.cos(np.deg2rad(ang))
-            horizontalalignment = {-1: "right", 1: "left"}[int(np.sign(x))]
-            connectionstyle = f"angle, angleA = 0, angleB = {ang}"
-            kw["arrowprops"].update({"connectionstyle": connectionstyle})
-            ax.annotate(
-                labels[i],
-                xy=(x, y),
-                xytext=(1.35 * np.sign(x), 1.4 * y),
-                horizontalalignment=horizontalalignment,
-                **kw,
-            )
+logger = logging.getLogger("conodictor")
 
-        ax.set_title("ConoDictor Predictions")
-        plt.savefig(
-            pathlib.Path(outdir, "superfamilies_distribution.png"), dpi=300
-        )
 
-    def cdpred(hmmclass, pssmclass):
-        """
-        Gives definitive classification by combining HMM
-        and PSSM classification.
-        Arguments:
-        - hmmclass  - HMM predicted family, required (string)
-        - pssmclass - PSSM predicted family, required (string)
-
-        """
-        deffam = None
-
-        if hmmclass == pssmclass:
-            deffam = hmmclass
-        elif "CONFLICT" in pssmclass and "CONFLICT" in hmmclass:
-            fams_pssm = re.search("(?<=CONFLICT)(.*)and(.*)", pssmclass)
-            fams_hmm = re.search("(?<=CONFLICT)(.*)and(.*)", hmmclass)
-            deffam = f"CONFLICT {fams_pssm.group(1)}, {fams_pssm.group(2)},"
-            +f" {fams_hmm.group(1)}, and {fams_hmm.group(2)}"
-        elif "CONFLICT" in pssmclass and "CONFLICT" not in hmmclass:
-            deffam = hmmclass
-        elif "CONFLICT" in hmmclass and "CONFLICT" not in pssmclass:
-            deffam = pssmclass
-        elif pssmclass != hmmclass:
-            deffam = f"CONFLICT {hmmclass} and {pssmclass}"
-
-        return deffam
-
-    def test_sequence(s):
-        """
-        Test sequence type
-        """
-        dna = "ATCG"
-        prot = "ABCDEFGHIKLMNPQRSTVWXYZ"
-        stype = ""
-
-        if all(i in dna for i in s):
-            stype = "DNA"
-        elif all(i in prot for i in s):
-            stype = "protein"
-        else:
-            stype = "unknown"
-
-        return stype
-
-    def get_pssm_fam(mdict):
-        """
-        Give predicted family by PSSM.
-
-        Argument:
-        - mdict - Dictionnary, required (dict)
-
-        Return the family with the highest number of occurence in PSSM profile
-        match recorded as list for each sequence id.
-
-        >>> my_dict = {ID1: ['A', 'A', 'B', 'M'], ID2: ['M', 'P', 'O1', 'O1']}
-        >>> get_pssm_fam(my_dict)
-        {ID1: 'A', ID2: 'O1'}
-        """
-        fam = ""
-        pssmfam = {}
-        for key in mdict.keys():
-            x = Counter(mdict[key])
-            # Take the top 2 item with highest count in list
-            possible_fam = x.most_common(2)
-
-            if len(possible_fam) == 1:
-                fam = possible_fam[0][0]
-            elif len(possible_fam) > 1:
-                if possible_fam[0][1] == possible_fam[1][1]:
-                    fam = (
-                        f"CONFLICT {possible_fam[0][0]}"
-                        + f" and {possible_fam[1][0]}"
-                    )
-                elif possible_fam[0][1] > possible_fam[1][1]:
-                    fam = possible_fam[0][0]
-                else:
-                    fam = possible_fam[1][0]
-
-            pssmfam[key] = fam
-
-        return pssmfam
-
-    def hmm_threshold(mdict):
-        """
-        Calculate evalue by family for each sequence.
-
-        Argument:
-        - mdict: Dictionnary, required (dict)
-
-        Return a dict with the evalue for each family.
-        """
-        score = defaultdict(dict)
-        for key in mdict.keys():
-            for k, v in mdict[key].items():
-                score[key][k] = reduce(mul, v, 1)
-
-        return score
-
-    def get_hmm_fam(mdict):
-        """
-        Get sequence family from hmm dictionnary.
-        """
-        conofam = ""
-        seqfam = {}
-        for key in mdict.keys():
-            two_smallest = nsmallest(2, mdict[key].values())
-
-            if len(two_smallest) == 1:
-                conofam = next(iter(mdict[key]))
-            elif two_smallest[0] * 100 != two_smallest[1]:
-                conofam = list(mdict[key].keys())[
-                    list(mdict[key].values()).index(two_smallest[0])
-                ]
-            elif two_smallest[0] * 100 == two_smallest[1]:
-                fam1 = list(mdict[key].keys())[
-                    list(mdict[key].values()).index(two_smallest[0])
-                ]
-                fam2 = list(mdict[key].keys())[
-                    list(mdict[key].values()).index(two_smallest[1])
-                ]
-                conofam = f"CONFLICT {fam1} and {fam2}"
-
-            seqfam[key] = conofam
-
-        return seqfam
-
-    def msg(text):
-        """
-        Produce nice message and info output on terminal.
-        """
-        t = datetime.now().strftime("%H:%M:%S")
-        line = f"[{t}] {text}"
-        if not os.path.exists(outdir):
-            with open(pathlib.Path(outdir, "conodictor.log"), "w"):
-                pass
-
-        logging.basicConfig(
-            filename=pathlib.Path(outdir, "conodictor.log"),
-            level=logging.INFO,
-        )
+def msg(text):
+    """
+    Produce nice message and info output on terminal.
+    """
+    t = datetime.now().strftime("%H:%M:%S")
+    logger.info(f"[{t}] {text}")
+
 
-        logging.info(line)
-
-    def translate_seq(seq):
-        """
-        Translate DNA sequence to proteins.
-        """
-        seqlist = []
-        # frame 1
-        seqlist.append(translate(seq))
-        # frame 2
-        seqlist.append(translate(seq[1:]))
-        # frame 3
-        seqlist.append(translate(seq[2:]))
-        # frame 4
-        seqlist.append(translate(reverse_complement(seq)))
-        # frame 5
-        seqlist.append(translate(reverse_complement(seq)[1:]))
-        # frame 6
-        seqlist.append(translate(reverse_complement(seq)[2:]))
-
-        return seqlist
-
-    def do_translation(infile, outfile, sw=60):
-
-        seqin = pyfastx.Fasta(infile)
-        with open(pathlib.Path(f"{outfile}_proteins.fa"), "w") as protfile:
-            for sequence in seqin:
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore")
-                    protseq = translate_seq(sequence.seq)
-                    for idx, frame in enumerate(protseq):
-                        # Rule E203 from flacke8 check for extraneous
-                        # whitespace before a colon. But black follow
-                        # PEP8 rules.
-                        # A PR is open to resolve this issue:
-                        # https://github.com/PyCQA/pycodestyle/pull/914
-                        seq_letters = [
-                            frame[i : i + sw]  # noqa: E203
-                            for i in range(0, len(frame), sw)
-                        ]
-                        nl = "\n"
-                        protfile.write(
-                            f">{sequence.name}_frame={idx + 1}\n"
-                            + f"{nl.join(map(str, seq_letters))}\n"
-                        )
-
-    VERSION = "2.1.3"
-
-    # Define start time------------------------------------------------------
-    startime = datetime.now()
-
-    # Handling db directory path specification-------------------------------
-    dbdir = pathlib.Path(os.path.dirname(os.path.realpath(__file__)), "db")
-
-    # Handling output directory creation-------------------------------------
+def open_run(outdir, force=False, keys=None, owner=None):
+    """
+    Create the output directory of a run and its log file.
+
+    Arguments:
+    - outdir - output directory, required (str)
+    - force  - reset an existing output directory (bool)
+    - keys   - stage keys of the run, to resume from its checkpoints (dict)
+    - owner  - id of the RQ job of the run (str)
+
+    An existing directory created by owner is kept when it holds
+    checkpoints of the run, reset otherwise. Any other existing directory
+    is refused unless force. Return the log handler, to remove from the
+    logger once the run is over.
+    """
     if os.path.isdir(outdir):
-        if force:
+        manifest = Manifest(outdir)
+        owned = owner is not None and manifest.owner == owner
+        stages = manifest.stages.values()
+        if (
+            keys
+            and manifest.owner == owner
+            and any(stage["key"] in keys.values() for stage in stages)
+        ):
+            print(f"Resuming run in {outdir}")
+        elif force or owned:
             print(f"Reusing outdir {outdir}")
             shutil.rmtree(outdir)
             os.mkdir(outdir)
+            Manifest(outdir).claim(owner)
         else:
             print(
                 f"conodictor: error: Your choosen output folder '{outdir}'"
@@ -291,201 +75,408 @@ def conodictor(infile, outdir, force=False, allres=False):
     else:
         print(f"Creating output directory {outdir}")
         os.mkdir(outdir)
+        Manifest(outdir).claim(owner)
 
-    # Start program ---------------------------------------------------------
-    msg(f"This is conodictor {VERSION}")
-    msg(f"Localtime is {datetime.now().strftime('%H:%M:%S')}")
+    return log_to(outdir)
 
-    # Getting version of tools ----------------------------------------------
-    sub_hmmsearch = subprocess.run(["hmmsearch", "-h"], capture_output=True)
-    hmmsearch_match = re.findall(
-        r"# HMMER\s+(\d+\.\d+)", sub_hmmsearch.stdout.decode("utf-8")
-    )
 
-    sub_pfscan = subprocess.run(["pfscanV3", "-h"], capture_output=True)
-    pfscan_match = re.findall(
-        r"Version\s+(\d+\.\d+\.\d+)", sub_pfscan.stdout.decode("utf-8")
-    )
+def log_to(outdir):
+    """
+    Send messages to outdir/conodictor.log, set up once rather than on
+    every message. Return the log handler.
+    """
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        handler.close()
+    handler = logging.FileHandler(pathlib.Path(outdir, "conodictor.log"))
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    logger.addHandler(handler)
+
+    return handler
+
+
+def prepare(infile, outdir, profile, context, orfs="met", min_orf=MIN_ORF):
+    """
+    Read the input of a run, translated when DNA, then drop duplicate and
+    hopeless sequences before the scans.
+
+    Return a JSON friendly dict of the run state: sequence type, paths of
+    the proteins read and of the proteins to scan, every sequence id,
+    duplicates by kept sequence and prefilter audited sequences.
+    """
+    msg(f"This is conodictor {VERSION}")
+    msg(f"Localtime is {datetime.now().strftime('%H:%M:%S')}")
 
     # Input sequence file manipulation---------------------------------------
+    if pyfastx.gzip_check(str(infile)):
+        msg("Your file is gzip compressed. Reading it as a stream.")
+    else:
+        msg("Your file is not gzip compressed")
 
-    # Open fasta file (build file index)
-    infa = pyfastx.Fasta(infile)
+    # Read input once, translating DNA on the fly
+    msg("Reading input sequences")
+    with profile.stage("translation"):
+        report, inpath, seqids = read_input(
+            infile, outdir, orfs=orfs, min_orf=min_orf
+        )
+    stype = report["type"]
+    msg(
+        f"Read {report['DNA']} DNA, {report['protein']} protein and"
+        + f" {report['unknown']} unknown sequences with"
+        + f" {report['ambiguous']} ambiguity codes"
+    )
 
     # Test if file type is accepted
-    if test_sequence(infa[1].seq) in ["DNA", "protein"]:
-        pass
-    else:
+    if stype == "unknown":
         msg(
             "Your file is not a DNA or protein file, please provide a DNA or"
             + " protein fasta file"
         )
         sys.exit(1)
-
-    # Test if file is gziped and translate
-    if infa.is_gzip:
-        # Decompress file
-        msg("Your file is gzip compressed. Decompressing it.")
-        with gzip.open(infile, "r") as seqh:
-            with open(
-                pathlib.Path(outdir, pathlib.Path(infile).stem), "wb"
-            ) as seqo:
-                shutil.copyfileobj(seqh, seqo)
-            seqo.close()
-        msg("Decompression done.")
-
-        # Read decompressed file
-        ingzfa = pyfastx.Fasta(
-            str(pathlib.Path(outdir, pathlib.Path(infile).stem))
+    msg(f"You provided {stype} fasta file")
+    profile.count("sequences", report[stype])
+    if stype == "DNA" and orfs:
+        profile.count("orfs", len(seqids))
+        msg(f"Kept {len(seqids)} ORFs of at least {min_orf} amino acids")
+    elif stype == "DNA":
+        profile.count("frames", len(seqids))
+    if stype == "DNA":
+        msg("Translation done!")
+
+    # Identical sequences are scanned once----------------------------------
+    dups, uniqpath = {}, None
+    if seqids:
+        with profile.stage("dedup"):
+            uniqpath = pathlib.Path(outdir, "unique_proteins.fa")
+            dups = dedup_fasta(inpath, uniqpath)
+        if not dups:
+            uniqpath = inpath
+        ndups = sum(len(names) for names in dups.values())
+        msg(
+            f"Collapsed {ndups} duplicate sequences into"
+            + f" {len(seqids) - ndups} unique ones"
         )
-
-        # Test if alphabet is DNA, or protein and translate or not
-        if test_sequence(ingzfa[1].seq) == "DNA":
-            msg("You provided DNA fasta file")
-            msg("Translating input sequences")
-            do_translation(
-                str(pathlib.Path(outdir, pathlib.Path(infile).stem)),
-                str(pathlib.Path(outdir, pathlib.Path(infile).stem)),
-            )
-            msg("Translation done!")
-            inpath = pathlib.Path(
-                outdir, f"{pathlib.Path(infile).stem}_proteins.fa"
+        profile.count("duplicates", ndups)
+
+    # Sequences that cannot hit are left out of the scans--------------------
+    scanpath = uniqpath
+    audited = []
+    if seqids and context.prefilter is not None:
+        with profile.stage("prefilter"):
+            scanpath = pathlib.Path(outdir, "prefiltered_proteins.fa")
+            rejected, audited = prefilter_fasta(
+                uniqpath, scanpath, context.prefilter
             )
-        elif test_sequence(ingzfa[1].seq) == "protein":
-            msg("You provided protein fasta file")
-            inpath = pathlib.Path(outdir, pathlib.Path(infile).stem)
-
-    elif not infa.is_gzip:
-        msg("Your file is not gzip compressed")
-        if test_sequence(infa[1].seq) == "DNA":
-            msg("You provided DNA fasta file")
-            msg("Translating input sequences")
-            do_translation(
-                str(pathlib.Path(infile)),
-                str(pathlib.Path(outdir, pathlib.Path(infile).stem)),
-            )
-            msg("Translation done!")
-            inpath = pathlib.Path(
-                outdir, f"{pathlib.Path(infile).stem}_proteins.fa"
-            )
-        elif test_sequence(infa[1].seq) == "protein":
-            msg("You provided protein fasta file")
-            inpath = infile
-
-    # Get sequence keys
-    infile = pyfastx.Fasta(str(inpath))
-    seqids = infile.keys()
-
-    # HMMs-------------------------------------------------------------------
-    msg("Running HMM prediction")
-    msg(f"Using hmmsearch v{hmmsearch_match[0]}")
-    subprocess.run(
-        [
-            "hmmsearch",
-            "-E",
-            "0.1",
-            "--noali",
-            "-o",
-            pathlib.Path(outdir, "out.hmmer"),
-            pathlib.Path(dbdir, "conodictor.hmm"),
-            inpath,
-        ]
+        msg(
+            f"Prefilter rejected {rejected} sequences, scanning"
+            + f" {len(audited)} of them anyway to check recall"
+        )
+        profile.count("prefilter_rejected", rejected)
+        profile.count("prefilter_audited", len(audited))
+        if not os.path.getsize(scanpath):
+            # Nothing left to scan, and pyfastx does not read empty files
+            os.remove(scanpath)
+            scanpath = None
+
+    msg("Running HMM and PSSM predictions")
+    msg(f"Using hmmsearch v{context.hmmsearch_version}")
+    msg(f"Using pfscan v{context.pfscan_version}")
+
+    return {
+        "type": stype,
+        "inpath": str(inpath),
+        "uniqpath": uniqpath and str(uniqpath),
+        "scanpath": scanpath and str(scanpath),
+        "seqids": seqids,
+        "dups": dups,
+        "audited": audited,
+    }
+
+
+def stage_keys(infile, context, allres=False, orfs="met", min_orf=MIN_ORF):
+    """
+    Keys of the checkpointed stages of a run: hashes of the input, the
+    options and the databases each stage depends on.
+    """
+    prefilter = context.prefilter is not None and (
+        MIN_KMERS,
+        KMER_SCORE,
+        AUDIT,
     )
-
-    hmmdict = defaultdict(lambda: defaultdict(list))
-
-    with open(pathlib.Path(outdir, "out.hmmer")) as hmmfile:
-        for record in SearchIO.parse(hmmfile, "hmmer3-text"):
-            hits = record.hits
-            for hit in hits:
-                hmmdict[hit.id][record.id.split("_")[1]].append(hit.evalue)
-    hmmfile.close()
-
-    hmmscore = hmm_threshold(hmmdict)
-    hmmfam = get_hmm_fam(hmmscore)
-
-    msg("Done with HMM prediction")
-
-    # PSSMs------------------------------------------------------------------
-    msg("Running PSSM prediction")
-    msg(f"Using pfscan v{pfscan_match[0]}")
-    pssm_run = subprocess.run(
-        [
-            "pfscanV3",
-            "-o",
-            "7",
-            pathlib.Path(dbdir, "conodictor.pssm"),
-            "-f",
-            inpath,
-        ],
-        capture_output=True,
+    keys = {
+        "translation": stage_key(
+            VERSION, checksum(infile), orfs, min_orf, prefilter
+        )
+    }
+    keys["hmm"] = stage_key(
+        keys["translation"], context.checksums["conodictor.hmm"]
     )
+    keys["pssm"] = stage_key(
+        keys["translation"], context.checksums["conodictor.pssm"]
+    )
+    keys["summary"] = stage_key(keys["hmm"], keys["pssm"], allres)
+
+    return keys
+
+
+def scan(scanpath, outdir, nseqs, profile, context, **kwargs):
+    """
+    Run the HMM and PSSM scans of a protein file, through the result cache
+    unless cachedb is None.
+
+    Arguments:
+    - scanpath - protein fasta file, required (str)
+    - outdir   - directory of the run, required (str)
+    - nseqs    - number of sequences of the whole run, required (int)
+    - profile  - run profile, required (Profile)
+    - context  - worker runtime context, required (RuntimeContext)
+
+    Keyword arguments are cachedb, workers and keep_raw of conodictor, and
+    manifest and keys to reuse the scans of a previous attempt and record
+    each scan as soon as it is done. Return hmmdict and pssmdict.
+    """
+    cachedb = kwargs.get("cachedb", DEFAULT_CACHE)
+    workers = kwargs.get("workers")
+    keep_raw = kwargs.get("keep_raw", False)
+    manifest = kwargs.get("manifest")
+    keys = kwargs.get("keys")
+
+    results = {}
+    if manifest is not None:
+        for name in ["hmm", "pssm"]:
+            result = manifest.load(name, keys[name])
+            if result is not None:
+                msg(f"Reusing the {name.upper()} results of a previous run")
+                results[name] = result
+
+    def done(name, result):
+        if manifest is not None:
+            manifest.save(name, keys[name], result)
+
+    missing = tuple(name for name in ["hmm", "pssm"] if name not in results)
+    if not missing:
+        hmmdict, pssmdict = results["hmm"], results["pssm"]
+    elif cachedb and len(missing) == 2:
+        hmmdict, pssmdict, hits, misses = cached_scan(
+            scanpath,
+            context.dbdir,
+            outdir,
+            nseqs,
+            cachedb,
+            workers,
+            keep_raw,
+            context.dbhash,
+            profile.tools,
+            done,
+        )
+        msg(f"Result cache: {hits} hits, {misses} misses")
+        profile.count("cache_hits", hits)
+        profile.count("cache_misses", misses)
+    else:
+        hmmdict, pssmdict = parallel_scan(
+            scanpath,
+            context.dbdir,
+            outdir,
+            nseqs,
+            workers,
+            keep_raw,
+            profile.tools,
+            missing,
+            done,
+        )
+        hmmdict = results.get("hmm", hmmdict)
+        pssmdict = results.get("pssm", pssmdict)
+
+    return hmmdict, pssmdict
+
+
+def conclude(
+    run,
+    hmmdict,
+    pssmdict,
+    outdir,
+    profile,
+    allres=False,
+    reports=False,
+    manifest=None,
+    key=None,
+):
+    """
+    Decide the families of a run from its scan results, write summary.txt
+    and record it in manifest under key when given, then finish the run.
+
+    Arguments:
+    - run      - run state as given by prepare, required (dict)
+    - hmmdict  - HMM e-values by family of scanned sequences, required
+    - pssmdict - PSSM families of scanned sequences, required
+    - outdir   - directory of the run, required (str)
+    - profile  - run profile, required (Profile)
+    """
+    seqids = run["seqids"]
+    fan_out(hmmdict, pssmdict, run["dups"])
+    if run["audited"]:
+        missed = sum(
+            name in hmmdict or name in pssmdict for name in run["audited"]
+        )
+        msg(
+            f"Prefilter audit: {missed} of {len(run['audited'])} rejected"
+            + " sequences have hits"
+        )
+        profile.count("prefilter_missed", missed)
+    profile.count("hmm_hits", sum(len(fams) for fams in hmmdict.values()))
+    profile.count("pssm_hits", sum(len(fams) for fams in pssmdict.values()))
 
-    with open(pathlib.Path(outdir, "out.pssm"), "w") as po:
-        po.write(pssm_run.stdout.decode("utf-8"))
-    po.close()
-
-    pssmdict = defaultdict(list)
-
-    with open(pathlib.Path(outdir, "out.pssm")) as pssmfile:
-        rd = csv.reader(pssmfile, delimiter="\t")
-        for row in rd:
-            pssmdict[row[3]].append((row[0].split("|")[0]).split("_")[1])
-    pssmfile.close()
-
-    pssmfam = get_pssm_fam(pssmdict)
+    with profile.stage("decision"):
+        hmmfam = hmm_families(hmmdict)
+        pssmfam = pssm_families(pssmdict)
+        summary = summarize(seqids, hmmfam, pssmfam, allres)
+    profile.count("predictions", len(summary))
 
-    msg("Done with PSSM predictions")
+    msg("Done with HMM and PSSM predictions")
 
     # Writing output---------------------------------------------------------
     msg("Writing output")
-    finalfam = defaultdict(list)
-    for sid in seqids:
-        if sid in hmmfam and sid in pssmfam:
-            finalfam[sid].extend(
-                [hmmfam[sid], pssmfam[sid], cdpred(hmmfam[sid], pssmfam[sid])]
-            )
-        elif sid in hmmfam and sid not in pssmfam:
-            finalfam[sid].extend([hmmfam[sid], "UNKNOWN", hmmfam[sid]])
-        elif sid in pssmfam and sid not in hmmfam:
-            finalfam[sid].extend(["UNKNOWN", pssmfam[sid], pssmfam[sid]])
-        else:
-            finalfam[sid].extend(["UNKOWN", "UNKOWN", "UNKNOWN"])
-
-    outfile = open(pathlib.Path(outdir, "summary.txt"), "a")
-    outfile.write("sequence\thmm_pred\tpssm_pred\tdefinitive_pred\n")
-    if not allres:
-        uniq_final = {
-            k: v
-            for k, v in finalfam.items()
-            if bool(set(v).intersection(["UNKNOWN", "UNKNOWN", "UNKNOWN"]))
-            is False
-        }
-        for uk, uv in uniq_final.items():
-            outfile.write(f"{uk}\t{uv[0]}\t{uv[1]}\t{uv[2]}\n")
-        outfile.close()
-    else:
-        for k, v in finalfam.items():
-            outfile.write(f"{k}\t{v[0]}\t{v[1]}\t{v[2]}\n")
-        outfile.close()
+    summarypath = pathlib.Path(outdir, "summary.txt")
+    with profile.stage("writing"):
+        write_summary(summary, summarypath)
     msg("Done with writing output.")
 
+    done = {
+        "type": run["type"],
+        "nseqs": len(seqids),
+        "paths": [run["inpath"], run["uniqpath"], run["scanpath"]],
+        "stages": profile.stages,
+        "counts": profile.counts,
+    }
+    if manifest is not None:
+        manifest.save("summary", key, done, [summarypath])
+    finish(done, outdir, profile, manifest, reports)
+
+
+def finish(done, outdir, profile, manifest=None, reports=False, record=True):
+    """
+    Remove the intermediate files and checkpoints of a run whose summary is
+    written, then build its reports when asked and write its profile.
+
+    Arguments:
+    - done     - summary checkpoint, as recorded by conclude (dict)
+    - outdir   - directory of the run, required (str)
+    - profile  - run profile, required (Profile)
+    - manifest - checkpoints of the run, the summary one is kept (Manifest)
+    - record   - add the profile to the worker metrics, false when resuming
+                 a run whose summary is written, already recorded (bool)
+    """
     # Finishing -------------------------------------------------------------
-    os.remove(pathlib.Path(outdir, "out.hmmer"))
-    os.remove(pathlib.Path(outdir, "out.pssm"))
-    os.remove(pathlib.Path(f"{inpath}.fxi"))
+    inpath, uniqpath, scanpath = done["paths"]
+    # Without duplicates or rejects the input itself is scanned, and kept
+    for path in [f"{inpath}.fxi", uniqpath, scanpath]:
+        if path == inpath:
+            continue
+        if path and os.path.exists(path):
+            os.remove(path)
+        if path and os.path.exists(f"{path}.fxi"):
+            os.remove(f"{path}.fxi")
+    if manifest is not None:
+        manifest.drop("translation", "hmm", "pssm")
     msg("Classification finished successfully.")
-    msg("Creating donut plot")
-    donut_graph()
-    msg("Done creating donut plot")
-    msg("Creating zip file")
-    shutil.make_archive(outdir, "zip", outdir)
-    msg("Done creating zip file")
-    msg(f"Check {outdir}.zip folder for results")
-    endtime = datetime.now()
-    walltime = endtime - startime
-    msg(f"Walltime used (hh:mm:ss.ms): {walltime}")
-    if len(seqids) % 2:
+    if reports:
+        msg("Creating donut plot and zip file")
+        with profile.stage("reports"):
+            build_reports(outdir)
+        msg("Done creating donut plot and zip file")
+        msg(f"Check {outdir}.zip folder for results")
+    msg(f"Walltime used (hh:mm:ss.ms): {profile.elapsed()}")
+    profile.write(pathlib.Path(outdir, "profile.json"))
+    if record:
+        record_profile(profile, done["type"])
+    if done["nseqs"] % 2:
         msg("Nice to have you. Share, enjoy and come back!")
     else:
         msg("Thanks you, come again.")
+
+
+def conodictor(
+    infile,
+    outdir,
+    force=False,
+    allres=False,
+    workers=None,
+    cachedb=DEFAULT_CACHE,
+    keep_raw=False,
+    context=None,
+    reports=False,
+    orfs="met",
+    min_orf=MIN_ORF,
+    resume=False,
+):
+    profile = Profile()
+
+    # Worker runtime context (tool versions, checked databases)-------------
+    context = context or get_context()
+
+    # Checkpoints of a previous attempt of this run--------------------------
+    # Only runs that may be resumed hash their input and keep checkpoints
+    keys, manifest = None, None
+    if resume:
+        keys = stage_keys(infile, context, allres, orfs, min_orf)
+    job = get_current_job()
+    handler = open_run(outdir, force, keys, job and job.id)
+    if resume:
+        manifest = Manifest(outdir)
+    done = manifest and manifest.load("summary", keys["summary"])
+    if done is not None:
+        msg("Resuming a run whose summary is written")
+        profile.stages.update(done["stages"])
+        profile.counts.update(done["counts"])
+        finish(done, outdir, profile, manifest, reports, record=False)
+        logger.removeHandler(handler)
+        return
+
+    run = manifest and manifest.load("translation", keys["translation"])
+    if run is None:
+        run = prepare(infile, outdir, profile, context, orfs, min_orf)
+        if manifest is not None:
+            manifest.save(
+                "translation",
+                keys["translation"],
+                dict(run, stages=profile.stages, counts=profile.counts),
+                [run["inpath"], run["uniqpath"], run["scanpath"]],
+            )
+    else:
+        msg("Resuming a run whose input is read and translated")
+        profile.stages.update(run["stages"])
+        profile.counts.update(run["counts"])
+
+    # HMMs and PSSMs---------------------------------------------------------
+    with profile.stage("scan"):
+        if not run["scanpath"]:
+            # DNA without any ORF long enough, or every sequence rejected
+            hmmdict, pssmdict = {}, {}
+        else:
+            hmmdict, pssmdict = scan(
+                run["scanpath"],
+                outdir,
+                len(run["seqids"]),
+                profile,
+                context,
+                cachedb=cachedb,
+                workers=workers,
+                keep_raw=keep_raw,
+                manifest=manifest,
+                keys=keys,
+            )
+
+    conclude(
+        run,
+        hmmdict,
+        pssmdict,
+        outdir,
+        profile,
+        allres,
+        reports,
+        manifest,
+        keys and keys["summary"],
+    )
+    logger.removeHandler(handler)
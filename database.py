@@ -0,0 +1,5 @@
+"""Database handle shared by the web app, its models and migrations."""
+from flask_sqlalchemy import SQLAlchemy
+
+
+db = SQLAlchemy()
@@ -0,0 +1,198 @@
+"""Columnar family decision engine for HMM and PSSM predictions."""
+from math import prod
+import numpy as np
+import pandas as pd
+
+
+def _ranked(seqcodes, keys):
+    """
+    Sort (sequence, family) groups by sequence then keys, keeping the first
+    seen order of families on ties, and locate the two best of each
+    sequence.
+
+    Return the sort order, the position of the best group of each sequence
+    and the position of the second best (-1 when there is none).
+    """
+    order = np.lexsort(keys + (seqcodes,))
+    sorted_seqs = seqcodes[order]
+    starts = np.flatnonzero(
+        np.concatenate(([True], sorted_seqs[1:] != sorted_seqs[:-1]))
+    )
+    nexts = starts + 1
+    has_second = nexts < len(order)
+    has_second[has_second] = (
+        sorted_seqs[nexts[has_second]] == sorted_seqs[starts[has_second]]
+    )
+    second = np.where(has_second, nexts, -1)
+
+    return order, starts, second
+
+
+def hmm_families(hmmdict):
+    """
+    Get sequence family from hmm dictionnary.
+
+    Argument:
+    - hmmdict - e-values by family for each sequence id, required (dict)
+
+    Return a Series of predicted family by sequence id. For each sequence
+    the e-values of a family are multiplied and the family with the
+    smallest product wins, or both best families are reported as CONFLICT
+    when the best product is exactly 100 times smaller than the second.
+    """
+    seqs, fams, scores = [], [], []
+    for idx, famdict in enumerate(hmmdict.values()):
+        for fam, evalues in famdict.items():
+            seqs.append(idx)
+            fams.append(fam)
+            scores.append(prod(evalues))
+    if not seqs:
+        return pd.Series(dtype=object)
+
+    seqs = np.array(seqs)
+    fams = np.array(fams, dtype=object)
+    scores = np.array(scores, dtype=float)
+    order, first, second = _ranked(seqs, (scores,))
+    best = order[first]
+    runner = order[second]
+
+    labels = fams[best]
+    conflict = (second >= 0) & (scores[best] * 100 == scores[runner])
+    for i in np.flatnonzero(conflict):
+        fam2 = fams[runner[i]]
+        # A tie on the best score names the first seen family twice
+        if scores[runner[i]] == scores[best[i]]:
+            fam2 = labels[i]
+        labels[i] = f"CONFLICT {labels[i]} and {fam2}"
+
+    return pd.Series(
+        labels, index=np.array(list(hmmdict), dtype=object)[seqs[best]]
+    )
+
+
+def pssm_families(pssmdict):
+    """
+    Give predicted family by PSSM.
+
+    Argument:
+    - pssmdict - matched families for each sequence id, required (dict)
+
+    Return a Series of the family with the highest number of occurence in
+    PSSM profile match for each sequence id, or a CONFLICT of the two first
+    seen families sharing the highest count.
+    """
+    seqs, fams = [], []
+    for idx, matches in enumerate(pssmdict.values()):
+        seqs.extend([idx] * len(matches))
+        fams.extend(matches)
+    if not seqs:
+        return pd.Series(dtype=object)
+
+    famcodes, famnames = pd.factorize(np.array(fams, dtype=object))
+    nfams = len(famnames)
+    # Count each (sequence, family) pair, keeping pairs in first seen order
+    pairs, first_seen, counts = np.unique(
+        np.array(seqs) * nfams + famcodes,
+        return_index=True,
+        return_counts=True,
+    )
+    seen = np.argsort(first_seen, kind="stable")
+    pairs, counts = pairs[seen], counts[seen]
+    seqcodes = pairs // nfams
+    famnames = np.asarray(famnames, dtype=object)[pairs % nfams]
+
+    order, first, second = _ranked(seqcodes, (-counts,))
+    best = order[first]
+    runner = order[second]
+
+    labels = famnames[best]
+    conflict = (second >= 0) & (counts[best] == counts[runner])
+    for i in np.flatnonzero(conflict):
+        labels[i] = f"CONFLICT {labels[i]} and {famnames[runner[i]]}"
+
+    return pd.Series(
+        labels, index=np.array(list(pssmdict), dtype=object)[seqcodes[best]]
+    )
+
+
+def cdpred(hmmclass, pssmclass):
+    """
+    Gives definitive classification by combining HMM
+    and PSSM classification.
+    Arguments:
+    - hmmclass  - HMM predicted family, required (string)
+    - pssmclass - PSSM predicted family, required (string)
+
+    """
+    if hmmclass == pssmclass:
+        return hmmclass
+    elif "CONFLICT" in pssmclass and "CONFLICT" in hmmclass:
+        pssm1, _, pssm2 = pssmclass.partition("CONFLICT")[2].rpartition("and")
+        hmm1, _, hmm2 = hmmclass.partition("CONFLICT")[2].rpartition("and")
+        return f"CONFLICT {pssm1}, {pssm2}, {hmm1}, and {hmm2}"
+    elif "CONFLICT" in pssmclass:
+        return hmmclass
+    elif "CONFLICT" in hmmclass:
+        return pssmclass
+
+    return f"CONFLICT {hmmclass} and {pssmclass}"
+
+
+def summarize(seqids, hmmfam, pssmfam, allres=False):
+    """
+    Build the summary table of predictions.
+
+    Arguments:
+    - seqids  - sequence ids in output order, required (list)
+    - hmmfam  - HMM predicted family by sequence id, required (Series)
+    - pssmfam - PSSM predicted family by sequence id, required (Series)
+    - allres  - keep sequences without both predictions (bool)
+
+    Return a DataFrame with hmm_pred, pssm_pred and definitive_pred columns
+    indexed by sequence.
+    """
+    index = pd.Index(list(seqids), name="sequence")
+    hmm = hmmfam.reindex(index).to_numpy()
+    pssm = pssmfam.reindex(index).to_numpy()
+    has_hmm = pd.notna(hmm)
+    has_pssm = pd.notna(pssm)
+    both = has_hmm & has_pssm
+
+    definitive = np.where(has_hmm, hmm, np.where(has_pssm, pssm, "UNKNOWN"))
+    # Only sequences predicted differently by both methods need a decision
+    differ = np.flatnonzero(both & (hmm != pssm))
+    definitive[differ] = [cdpred(hmm[i], pssm[i]) for i in differ]
+
+    summary = pd.DataFrame(
+        {
+            "hmm_pred": np.where(
+                has_hmm, hmm, np.where(has_pssm, "UNKNOWN", "UNKOWN")
+            ),
+            "pssm_pred": np.where(
+                has_pssm, pssm, np.where(has_hmm, "UNKNOWN", "UNKOWN")
+            ),
+            "definitive_pred": definitive,
+        },
+        index=index,
+    )
+    if not allres:
+        summary = summary[both]
+
+    return summary
+
+
+def write_summary(summary, path):
+    """
+    Append the summary table to path as tab separated text.
+    """
+    with open(path, "a") as outfile:
+        outfile.write("sequence\thmm_pred\tpssm_pred\tdefinitive_pred\n")
+        outfile.writelines(
+            f"{sid}\t{hmm}\t{pssm}\t{final}\n"
+            for sid, hmm, pssm, final in zip(
+                summary.index.tolist(),
+                summary["hmm_pred"].tolist(),
+                summary["pssm_pred"].tolist(),
+                summary["definitive_pred"].tolist(),
+            )
+        )
@@ -0,0 +1,207 @@
+"""Distributed conodictor runs as RQ map and reduce jobs.
+
+A split job reads the input, writes the proteins to scan in shards of
+balanced residue count and queues one scan job per shard, then a reduce
+job depending on all of them. Any worker listening to the queue of the
+split job may pick up a shard, so job timeouts apply per shard. The reduce
+job merges the HMM and PSSM results, writes summary.txt and builds the
+plot and the archive.
+
+Shards and their results are files of the job output directory, which
+must be shared by every worker node, as it already is with the web app.
+"""
+from cache import DEFAULT_CACHE
+from conodictor import conclude, log_to, logger, msg, open_run, prepare, scan
+import json
+import os
+import pathlib
+from profiling import Profile
+import pyfastx
+from rq import get_current_job, Queue
+from runtime import get_context
+from search import shard_fasta
+import shutil
+import time
+from translation import MIN_ORF
+
+
+STATE = "distributed.json"
+SHARDS_FOLDER = "shards"
+
+
+def split_job(
+    infile,
+    outdir,
+    shard_residues,
+    shard_timeout,
+    force=False,
+    allres=False,
+    cachedb=DEFAULT_CACHE,
+    orfs="met",
+    min_orf=MIN_ORF,
+    retry=None,
+):
+    """
+    First job of a distributed run.
+
+    Arguments:
+    - infile         - DNA or protein fasta file, required (str)
+    - outdir         - output directory, required (str)
+    - shard_residues - protein residues scanned by each shard job (int)
+    - shard_timeout  - timeout in seconds of each shard job (int)
+    - retry          - retry policy of the shard and reduce jobs (rq.Retry)
+
+    Other arguments are those of conodictor. Outside of an RQ job, shards
+    are scanned and reduced in this process. Return the shard paths.
+    """
+    started = time.time()
+    profile = Profile()
+    context = get_context()
+    job = get_current_job()
+    # A retried split job starts over in the directory it created
+    handler = open_run(outdir, force, owner=job and job.id)
+    run = prepare(infile, outdir, profile, context, orfs, min_orf)
+
+    shards = []
+    if run["scanpath"]:
+        scanpath = run["scanpath"]
+        residues = sum(
+            len(seq) for _, seq in pyfastx.Fasta(scanpath, build_index=False)
+        )
+        shards = shard_fasta(
+            scanpath,
+            max(1, -(-residues // shard_residues)),
+            pathlib.Path(outdir, SHARDS_FOLDER),
+        )
+        os.remove(f"{scanpath}.fxi")
+        msg(f"Split {residues} residues to scan in {len(shards)} shards")
+    run.update(
+        started=started,
+        allres=allres,
+        shards=[str(shard) for shard in shards],
+        stages=profile.stages,
+        counts=profile.counts,
+    )
+    with open(pathlib.Path(outdir, STATE), "w") as statefile:
+        json.dump(run, statefile)
+    logger.removeHandler(handler)
+
+    nseqs = len(run["seqids"])
+    if job is None:
+        for shard in shards:
+            scan_shard(shard, nseqs, cachedb)
+        reduce_job(outdir)
+        return shards
+
+    queue = Queue(job.origin, connection=job.connection)
+    scans = [
+        queue.enqueue(
+            scan_shard,
+            args=(str(shard), nseqs, cachedb),
+            job_id=f"{job.id}-shard-{i}",
+            job_timeout=shard_timeout,
+            result_ttl=5000,
+            retry=retry,
+        )
+        for i, shard in enumerate(shards)
+    ]
+    reducer = queue.enqueue(
+        reduce_job,
+        args=(outdir,),
+        job_id=f"{job.id}-reduce",
+        depends_on=scans or None,
+        job_timeout=job.timeout,
+        result_ttl=5000,
+        retry=retry,
+    )
+    job.meta["shards"] = [scan.id for scan in scans]
+    job.meta["reduce"] = reducer.id
+    job.save_meta()
+
+    return shards
+
+
+def result_path(shard):
+    """
+    Path of the JSON results of a shard.
+    """
+    return pathlib.Path(shard).with_suffix(".json")
+
+
+def scan_shard(shard, nseqs, cachedb=DEFAULT_CACHE):
+    """
+    Scan a shard of a distributed run and write its results next to it.
+
+    Arguments:
+    - shard   - protein fasta file, required (str)
+    - nseqs   - number of sequences of the whole run, required (int)
+    - cachedb - path of the result cache, None to scan everything (str)
+    """
+    profile = Profile()
+    context = get_context()
+    # Shards run concurrently, each one in a directory of its own
+    workdir = pathlib.Path(shard).with_suffix("")
+    os.makedirs(workdir, exist_ok=True)
+    with profile.stage("scan"):
+        hmmdict, pssmdict = scan(
+            shard, workdir, nseqs, profile, context, cachedb=cachedb
+        )
+    shutil.rmtree(workdir)
+    if os.path.exists(f"{shard}.fxi"):
+        os.remove(f"{shard}.fxi")
+
+    tmppath = pathlib.Path(f"{result_path(shard)}.{os.getpid()}")
+    with open(tmppath, "w") as jsonfile:
+        json.dump(
+            {
+                "hmm": hmmdict,
+                "pssm": pssmdict,
+                "seconds": profile.stages["scan"],
+                "tools": profile.tools,
+                "counts": profile.counts,
+            },
+            jsonfile,
+        )
+    os.replace(tmppath, result_path(shard))
+
+
+def reduce_job(outdir):
+    """
+    Last job of a distributed run: merge the results of its shards, then
+    write summary.txt, the plot and the archive.
+    """
+    handler = log_to(outdir)
+    with open(pathlib.Path(outdir, STATE)) as statefile:
+        run = json.load(statefile)
+    profile = Profile()
+    profile.start -= time.time() - run["started"]
+    profile.stages.update(run["stages"])
+    profile.counts.update(run["counts"])
+
+    hmmdict, pssmdict = {}, {}
+    for shard in run["shards"]:
+        with open(result_path(shard)) as jsonfile:
+            result = json.load(jsonfile)
+        hmmdict.update(result["hmm"])
+        pssmdict.update(result["pssm"])
+        # Shard walltimes are summed like the tool walltimes of a run
+        profile.stages["scan"] = profile.stages.get("scan", 0) + round(
+            result["seconds"], 3
+        )
+        for name, seconds in result["tools"].items():
+            profile.tools[name] = profile.tools.get(name, 0) + seconds
+        for name, value in result["counts"].items():
+            profile.counts[name] = profile.counts.get(name, 0) + value
+    if "cache_hits" in profile.counts:
+        msg(
+            f"Result cache: {profile.counts['cache_hits']} hits,"
+            + f" {profile.counts['cache_misses']} misses"
+        )
+    msg(f"Merged the results of {len(run['shards'])} shards")
+
+    conclude(
+        run, hmmdict, pssmdict, outdir, profile, run["allres"], reports=True
+    )
+    shutil.rmtree(pathlib.Path(outdir, SHARDS_FOLDER), ignore_errors=True)
+    os.remove(pathlib.Path(outdir, STATE))
+    logger.removeHandler(handler)
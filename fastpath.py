@@ -0,0 +1,78 @@
+"""Classification of small pasted inputs, run by fast queue workers."""
+from alphabet import alphabet_report, classify_records, parse_fasta
+from concurrent.futures import ThreadPoolExecutor
+from decision import hmm_families, pssm_families, summarize
+import pathlib
+from runtime import get_context
+from search import hmm_search, pssm_scan
+import tempfile
+from translation import MIN_ORF, translate_orfs, translate_records
+
+
+# Warm threads running hmmsearch and pfscanV3 side by side
+POOL = ThreadPoolExecutor(max_workers=4)
+
+
+def classify_text(text, allres=False, orfs="met", min_orf=MIN_ORF):
+    """
+    Classify pasted sequences in this process, without conodictor runs and
+    their output directory.
+
+    Arguments:
+    - text    - DNA or protein sequences, fasta or bare, required (str)
+    - allres  - keep sequences without both predictions (bool)
+    - orfs    - ORFs kept from DNA translations, as in conodictor
+    - min_orf - shortest ORF kept, in amino acids (int)
+
+    Return the summary table as given by decision.summarize. Raise
+    ValueError when the text is neither DNA nor proteins.
+    """
+    if orfs not in ["met", "stop", None]:
+        raise ValueError(f"Unknown ORF mode {orfs}")
+    records = [
+        (name or "sequence", seq) for name, seq in parse_fasta(text)
+    ]
+    stype = alphabet_report(classify_records(records))["type"]
+    if stype == "unknown":
+        raise ValueError("Input data is not DNA nor proteins.")
+
+    if stype == "DNA" and orfs:
+        proteins, seqids = translate_orfs(records, min_orf, orfs == "met")
+    elif stype == "DNA":
+        proteins = translate_records(records)
+        seqids = [
+            f"{name}_frame={idx}" for name, _ in records for idx in range(1, 7)
+        ]
+    else:
+        proteins = b"".join(
+            b">%s\n%s\n" % (name.encode("utf-8"), seq)
+            for name, seq in records
+        )
+        seqids = [name for name, _ in records]
+
+    if not seqids:
+        return summarize(seqids, hmm_families({}), pssm_families({}), allres)
+
+    context = get_context()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inpath = pathlib.Path(tmpdir, "proteins.fa")
+        with open(inpath, "wb") as protfile:
+            protfile.write(proteins)
+        hmm_job = POOL.submit(
+            hmm_search, inpath, context.hmmdb, len(seqids)
+        )
+        pssm_job = POOL.submit(pssm_scan, inpath, context.pssmdb)
+        hmmfam = hmm_families(hmm_job.result())
+        pssmfam = pssm_families(pssm_job.result())
+
+    return summarize(seqids, hmmfam, pssmfam, allres)
+
+
+def classify_rows(text, allres=False, orfs="met", min_orf=MIN_ORF):
+    """
+    Fast queue job of the web app: rows of the classify_text summary, as
+    plain lists the web process reads without pandas.
+    """
+    summary = classify_text(text, allres, orfs, min_orf)
+
+    return summary.reset_index().values.tolist()
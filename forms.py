@@ -25,5 +25,5 @@ class RunForm(Form):
     job_id = StringField(
         "Your Job name",
         [DataRequired()],
-        default=jobid_generator(),
+        default=jobid_generator,
     )
@@ -0,0 +1,108 @@
+"""Streaming reader of input fasta files."""
+from alphabet import classify
+from itertools import chain, islice
+import os
+import pathlib
+import pyfastx
+from translation import MIN_ORF, translate_orfs, translate_records
+
+
+def checked(records, report):
+    """
+    Yield (name, sequence) records while they share the type of the first
+    one, counting record types and ambiguity codes in report. Reading stops
+    and the report type becomes unknown at the first unknown or
+    mismatching record.
+    """
+    for name, seq in records:
+        stype, ambiguous = classify(seq)
+        report[stype] += 1
+        report["ambiguous"] += ambiguous
+        report["type"] = report["type"] or stype
+        if stype != report["type"] or stype == "unknown":
+            report["type"] = "unknown"
+            return
+        yield name, seq
+
+
+def read_input(
+    infile, outdir, sw=60, batch_size=1000, orfs="met", min_orf=MIN_ORF
+):
+    """
+    Read an input fasta file once, gzipped or not.
+
+    Arguments:
+    - infile     - DNA or protein fasta file, required (str)
+    - outdir     - directory where the protein file is written, required
+    - sw         - line width of the protein fasta file (int)
+    - batch_size - number of records handled per write (int)
+    - orfs       - ORFs kept from DNA translations, "met" for Met-to-stop,
+                   "stop" for stop-to-stop or None for six full frames
+    - min_orf    - shortest ORF kept, in amino acids (int)
+
+    Return the alphabet report of the file (see alphabet.alphabet_report),
+    the protein fasta file to scan and its sequence ids. Every record is
+    classified; files mixing DNA and proteins or with unknown records are
+    reported as unknown.
+
+    Uncompressed protein files are scanned in place. Other inputs are
+    decompressed, and translated in six frames when DNA, batch by batch as
+    they are read, so only the protein file reaches the disk. ORFs of DNA
+    records are named after their contig coordinates, see
+    translation.translate_orfs.
+    """
+    if orfs not in ["met", "stop", None]:
+        raise ValueError(f"Unknown ORF mode {orfs}")
+    # pyfastx restarts from the top of the file on each iter() call
+    records = (rec for rec in pyfastx.Fasta(str(infile), build_index=False))
+    report = {"DNA": 0, "protein": 0, "unknown": 0, "ambiguous": 0}
+    report["type"] = None
+    records = checked(records, report)
+    first = next(records, None)
+    stype = report["type"] = report["type"] or "unknown"
+    if stype == "unknown":
+        return report, None, []
+
+    records = chain([first], records)
+    stem = pathlib.Path(infile).stem
+    if stype == "protein" and not pyfastx.gzip_check(str(infile)):
+        seqids = [name for name, _ in records]
+        if report["type"] == "unknown":
+            return report, None, []
+        return report, pathlib.Path(infile), seqids
+
+    seqids = []
+    if stype == "DNA":
+        outpath = pathlib.Path(outdir, f"{stem}_proteins.fa")
+    else:
+        outpath = pathlib.Path(outdir, stem)
+    with open(outpath, "wb", buffering=1 << 20) as outfile:
+        batch = list(islice(records, batch_size))
+        while batch:
+            if stype == "DNA" and orfs:
+                proteins, ids = translate_orfs(
+                    batch, min_orf, orfs == "met", sw
+                )
+                outfile.write(proteins)
+                seqids.extend(ids)
+            elif stype == "DNA":
+                outfile.write(translate_records(batch, sw))
+                seqids.extend(
+                    f"{name}_frame={idx}"
+                    for name, _ in batch
+                    for idx in range(1, 7)
+                )
+            else:
+                outfile.write(
+                    "".join(f">{name}\n{seq}\n" for name, seq in batch).encode(
+                        "utf-8"
+                    )
+                )
+                seqids.extend(name for name, _ in batch)
+            batch = list(islice(records, batch_size))
+
+    if report["type"] == "unknown":
+        os.remove(outpath)
+        return report, None, []
+
+    return report, outpath, seqids
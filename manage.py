@@ -2,7 +2,8 @@ import os
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
-from app import app, db
+from app import app
+from database import db
 
 app.config.from_object(os.environ["APP_SETTINGS"])
 
@@ -0,0 +1,91 @@
+"""Prometheus style metrics shared by the web app and the workers.
+
+Counters and histograms are kept in Redis hashes, so that every forked RQ
+job and every web process add to the same series. The web app renders them
+in the Prometheus text format on /metrics.
+"""
+from rq import get_current_job
+
+
+PREFIX = "conodictor:metrics"
+# Histogram upper bounds in seconds
+BUCKETS = [0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, 14400]
+
+
+def _labels(labels):
+    return ",".join(f'{key}="{val}"' for key, val in sorted(labels.items()))
+
+
+def inc(conn, name, value=1, **labels):
+    """
+    Add value to the counter name with labels.
+    """
+    conn.hincrbyfloat(f"{PREFIX}:counter:{name}", _labels(labels), value)
+
+
+def observe(conn, name, value, **labels):
+    """
+    Add value to the histogram name with labels.
+    """
+    key = f"{PREFIX}:histogram:{name}"
+    series = _labels(labels)
+    pipe = conn.pipeline(transaction=False)
+    for bound in BUCKETS:
+        if value <= bound:
+            pipe.hincrbyfloat(key, f"{series}\t{bound}", 1)
+    pipe.hincrbyfloat(key, f"{series}\t+Inf", 1)
+    pipe.hincrbyfloat(key, f"{series}\tsum", value)
+    pipe.execute()
+
+
+def _series(name, labels, extra=""):
+    labels = ",".join(filter(None, [labels, extra]))
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def render(conn):
+    """
+    Every counter and histogram in the Prometheus text format.
+    """
+    lines = []
+    for key in sorted(conn.scan_iter(f"{PREFIX}:*")):
+        kind, name = key.decode("utf-8")[len(PREFIX) + 1:].split(":", 1)
+        fields = {
+            field.decode("utf-8"): float(value)
+            for field, value in conn.hgetall(key).items()
+        }
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for labels, value in sorted(fields.items()):
+                lines.append(f"{_series(name, labels)} {value:g}")
+            continue
+        series = sorted({field.partition("\t")[0] for field in fields})
+        for labels in series:
+            for bound in BUCKETS + ["+Inf"]:
+                value = fields.get(f"{labels}\t{bound}", 0)
+                line = _series(f"{name}_bucket", labels, f'le="{bound}"')
+                lines.append(f"{line} {value:g}")
+            count = fields.get(f"{labels}\t+Inf", 0)
+            total = fields.get(f"{labels}\tsum", 0)
+            lines.append(f"{_series(name + '_count', labels)} {count:g}")
+            lines.append(f"{_series(name + '_sum', labels)} {total:g}")
+
+    return "\n".join(lines) + "\n"
+
+
+def record_profile(profile, stype):
+    """
+    Add a conodictor profile to the metrics, when run as an RQ job.
+    """
+    job = get_current_job()
+    if job is None:
+        return
+    conn = job.connection
+    for name, seconds in profile.stages.items():
+        observe(conn, "conodictor_stage_seconds", seconds, stage=name)
+    for name, seconds in profile.tools.items():
+        inc(conn, "conodictor_tool_seconds_total", seconds, tool=name)
+    for name, value in profile.counts.items():
+        inc(conn, f"conodictor_{name}_total", value, type=stype)
+    observe(conn, "conodictor_job_seconds", profile.to_dict()["walltime"])
+    inc(conn, "conodictor_jobs_total", type=stype)
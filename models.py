@@ -1,18 +1,24 @@
-from app import db
+from database import db
 
 
 class Result(db.Model):
     __tablename__ = "results"
 
     id = db.Column(db.Integer, primary_key=True)
-    job_name = db.Column(db.String())
+    job_name = db.Column(db.String(), index=True)
     result_url = db.Column(db.String())
     infile = db.Column(db.String())
+    # sha256 of the normalized input records and of the databases
+    input_hash = db.Column(db.String(64), index=True)
+    # Job whose outputs are served, job_name itself unless deduplicated
+    origin = db.Column(db.String())
 
-    def __init__(self, id, job_name, result_url, infile):
+    def __init__(self, job_name, result_url, infile, input_hash, origin):
         self.job_name = job_name
         self.result_url = result_url
         self.infile = infile
+        self.input_hash = input_hash
+        self.origin = origin
 
     def __repr__(self):
-        return "<id f{self.job_name}>"
+        return f"<id {self.job_name}>"
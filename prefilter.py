@@ -0,0 +1,209 @@
+"""K-mer and cysteine prefilter of sequences before the HMM and PSSM scans.
+
+The index gives, for every amino acid k-mer, the HMMs of conodictor.hmm it
+is likely to come from: a k-mer is indexed for a model when its log-odds
+score against some k consecutive match states of the model reaches a
+threshold. It is built once, saved next to the HMM database and memory
+mapped by the workers.
+
+A sequence goes on to the scans when it holds enough indexed k-mers of one
+model, or enough cysteines close together to carry a conotoxin framework.
+A sample of the rejected sequences is scanned anyway, so that each job
+measures what the prefilter would have missed. The prefilter is turned on
+by setting CONODICTOR_PREFILTER to the k-mers a sequence needs.
+"""
+from functools import lru_cache
+from itertools import islice
+import numpy as np
+import os
+import pathlib
+import pyfastx
+import random
+from runtime import checksum
+
+
+# Amino acids in the column order of HMMER3 files
+AMINO = "ACDEFGHIKLMNPQRSTVWY"
+K = 4
+# Smallest log-odds score in nats of the k-mers indexed for a model
+KMER_SCORE = float(os.getenv("CONODICTOR_PREFILTER_SCORE", "8"))
+# Indexed k-mers of one model a sequence needs, 0 turns the prefilter off.
+# Off by default: it loses hits, see benchmark.py --prefilter
+MIN_KMERS = int(os.getenv("CONODICTOR_PREFILTER", "0"))
+# Sequences with that many cysteines in a window of CYS_WINDOW residues, a
+# mature region framework, always go on to the scans
+MIN_CYSTEINES = 4
+CYS_WINDOW = 40
+# Fraction of the rejected sequences scanned anyway to measure recall
+AUDIT = float(os.getenv("CONODICTOR_PREFILTER_AUDIT", "0.01"))
+
+CODES = np.full(256, 255, dtype=np.uint8)
+for _idx, _aa in enumerate(AMINO):
+    CODES[ord(_aa)] = CODES[ord(_aa.lower())] = _idx
+
+
+def read_hmms(path):
+    """
+    Read the match emissions of a HMMER3 database.
+
+    Argument:
+    - path - HMMER3 text file, required (str)
+
+    Return the model names and, for each model, an array of shape (match
+    states, 20) of emission log-odds in nats against the insert emissions
+    of the model, its background.
+    """
+    names, models = [], []
+    with open(path) as hmmfile:
+        for line in hmmfile:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == "NAME":
+                names.append(fields[1])
+                matches, background = [], None
+            elif fields[0] == "COMPO" or (
+                fields[0].isdigit() and len(fields) > len(AMINO)
+            ):
+                if fields[0] != "COMPO":
+                    matches.append([float(v) for v in fields[1:21]])
+                # Insert emissions follow, the same for every state
+                inserts = next(hmmfile).split()
+                if background is None:
+                    background = np.array([float(v) for v in inserts])
+            elif fields[0] == "//":
+                # Scores are stored as negative natural logs
+                models.append(background - np.array(matches))
+
+    return names, models
+
+
+def build_index(names, models, k=K, min_score=KMER_SCORE):
+    """
+    Index the k-mers of each model scoring min_score or more.
+
+    Return a uint64 array of 20 ** k bit masks, bit i set when the k-mer
+    is indexed for model i.
+    """
+    if len(models) > 64:
+        raise ValueError(f"{len(models)} models do not fit a 64 bit mask")
+    table = np.zeros(len(AMINO) ** k, dtype=np.uint64)
+    for bit, odds in enumerate(models):
+        for start in range(len(odds) - k + 1):
+            scores = odds[start]
+            for row in odds[start + 1:start + k]:
+                scores = np.add.outer(scores, row).ravel()
+            table[scores >= min_score] |= np.uint64(1 << bit)
+
+    return table
+
+
+@lru_cache(maxsize=4)
+def load_index(hmmpath, k=K, min_score=KMER_SCORE):
+    """
+    Memory mapped k-mer index of a HMM database, built on first use.
+
+    The index is saved next to the database, named after its k, score and
+    checksum so that a new database or setting gets a new index.
+    """
+    hmmpath = pathlib.Path(hmmpath)
+    path = pathlib.Path(
+        hmmpath.parent,
+        f"{hmmpath.name}.k{k}s{min_score:g}.{checksum(hmmpath)[:16]}.npy",
+    )
+    if not path.exists():
+        table = build_index(*read_hmms(hmmpath), k, min_score)
+        tmppath = pathlib.Path(path.parent, f".{path.name}.{os.getpid()}")
+        with open(tmppath, "wb") as tmpfile:
+            np.save(tmpfile, table)
+        os.replace(tmppath, path)
+
+    return np.load(path, mmap_mode="r")
+
+
+def plausible(seqs, table, min_kmers=MIN_KMERS, min_cys=MIN_CYSTEINES):
+    """
+    Tell which protein sequences may hit.
+
+    Arguments:
+    - seqs      - protein sequences, required (list of str)
+    - table     - k-mer index as given by load_index, required
+    - min_kmers - indexed k-mers of one model a sequence needs (int)
+    - min_cys   - cysteines in CYS_WINDOW residues making a sequence pass
+                  anyway (int)
+
+    Return a boolean array, True for sequences to scan.
+    """
+    k = round(np.log(len(table)) / np.log(len(AMINO)))
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    text = "".join(seqs).encode("ascii", "replace")
+    # One padding residue keeps every start a valid reduceat index
+    codes = CODES[np.frombuffer(text + b"*", np.uint8)]
+    size = len(codes) - 1
+    position = np.arange(size + 1)
+    seqend = np.append(np.repeat(ends, lengths), size)
+
+    # Cysteines in the window starting at each residue
+    total = np.concatenate(([0], np.cumsum(codes == AMINO.index("C"))))
+    window = total[np.minimum(position + CYS_WINDOW, seqend)] - total[:-1]
+    cysteines = np.maximum.reduceat(window, starts)
+
+    # k-mers over unknown residues or across two sequences are not indexed
+    kmers = np.zeros(size, dtype=np.int64)
+    usable = position[:-1] + k <= seqend[:-1]
+    for offset in range(k):
+        window = codes[offset:offset + size]
+        window = np.concatenate(
+            (window, np.full(size - len(window), 255, np.uint8))
+        )
+        kmers = kmers * len(AMINO) + window % len(AMINO)
+        usable &= window != 255
+    masks = np.where(usable, table[kmers], np.uint64(0))
+    bits = np.unpackbits(
+        np.append(masks, np.uint64(0)).view(np.uint8).reshape(-1, 8),
+        axis=1,
+        bitorder="little",
+    )
+    counts = np.add.reduceat(bits, starts, axis=0, dtype=np.int32)
+    counts[lengths == 0] = 0
+    cysteines[lengths == 0] = 0
+
+    return (counts.max(axis=1) >= min_kmers) | (cysteines >= min_cys)
+
+
+def prefilter_fasta(inpath, outpath, table, audit=AUDIT, batch=1000):
+    """
+    Keep the protein sequences that may hit, and an audit sample of the
+    others.
+
+    Arguments:
+    - inpath  - protein fasta file, required (str)
+    - outpath - file where kept sequences are written, required (str)
+    - table   - k-mer index as given by load_index, required
+    - audit   - fraction of the rejected sequences kept anyway (float)
+    - batch   - sequences looked at together (int)
+
+    Return the number of rejected sequences and the ids of the audited ones,
+    the same from one run to the next.
+    """
+    rng = random.Random(0)
+    rejected, audited = 0, []
+    # A generator, iterating a pyfastx.Fasta again starts it over
+    fasta = pyfastx.Fasta(str(inpath), build_index=False)
+    records = (record for record in fasta)
+    with open(outpath, "w") as outfile:
+        chunk = list(islice(records, batch))
+        while chunk:
+            passed = plausible([seq for _, seq in chunk], table)
+            for (name, seq), keep in zip(chunk, passed):
+                if not keep:
+                    rejected += 1
+                    if rng.random() >= audit:
+                        continue
+                    audited.append(name)
+                outfile.write(f">{name}\n{seq}\n")
+            chunk = list(islice(records, batch))
+
+    return rejected, audited
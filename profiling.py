@@ -0,0 +1,84 @@
+"""Per-stage timers, counts and peak memory of a conodictor run."""
+from contextlib import contextmanager
+from datetime import timedelta
+import json
+from progress import stage
+import resource
+import time
+
+
+def peak_rss():
+    """
+    Peak resident memory in bytes of this process and of its largest
+    finished child process, such as hmmsearch or pfscanV3.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "children": (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        ),
+    }
+
+
+class Profile(object):
+    """
+    Structured profile of a conodictor run.
+
+    Stage walltimes are in seconds, counts are numbers of sequences, frames
+    or hits and peak RSS is sampled at the end of each stage.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.tools = {}
+        self.counts = {}
+        self.rss = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage, also reported in the RQ job meta by progress.stage.
+        """
+        start = time.perf_counter()
+        try:
+            with stage(name):
+                yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + round(
+                time.perf_counter() - start, 3
+            )
+            self.rss[name] = peak_rss()
+
+    def count(self, name, value):
+        """
+        Set the count of name.
+        """
+        self.counts[name] = value
+
+    def elapsed(self):
+        """
+        Walltime since the run started.
+        """
+        return timedelta(seconds=time.perf_counter() - self.start)
+
+    def to_dict(self):
+        """
+        Profile as a JSON friendly dict.
+        """
+        return {
+            "walltime": round(time.perf_counter() - self.start, 3),
+            "stages": self.stages,
+            "tools": {name: round(sec, 3) for name, sec in self.tools.items()},
+            "counts": self.counts,
+            "peak_rss": peak_rss(),
+            "stage_rss": self.rss,
+        }
+
+    def write(self, path):
+        """
+        Write the profile as JSON to path.
+        """
+        with open(path, "w") as jsonfile:
+            json.dump(self.to_dict(), jsonfile, indent=2)
@@ -0,0 +1,111 @@
+"""Pipeline progress written into the meta of the running RQ job."""
+from contextlib import contextmanager
+from rq import get_current_job
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+import time
+
+
+# Stages of a conodictor job, in run order
+STAGES = [
+    "translation",
+    "dedup",
+    "prefilter",
+    "scan",
+    "decision",
+    "writing",
+]
+
+
+@contextmanager
+def stage(name):
+    """
+    Record a pipeline stage in the current RQ job meta.
+
+    Argument:
+    - name - stage name, one of STAGES (str)
+
+    Set meta["stage"] on entry and add the stage walltime in seconds to
+    meta["timings"] on exit. Does nothing outside of an RQ job.
+    """
+    job = get_current_job()
+    if job is None:
+        yield
+        return
+
+    job.meta["stage"] = name
+    job.meta.setdefault("timings", {})
+    job.save_meta()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        job.meta["timings"][name] = round(time.perf_counter() - start, 3)
+        job.save_meta()
+
+
+def job_status(job):
+    """
+    JSON friendly status of a job: RQ state, current stage and timings.
+    """
+    job.refresh()
+    status = {
+        "job": job.id,
+        "state": job.get_status(refresh=False),
+        "stage": job.meta.get("stage"),
+        "timings": job.meta.get("timings", {}),
+        "enqueued_at": job.enqueued_at,
+        "started_at": job.started_at,
+        "ended_at": job.ended_at,
+    }
+    for key in ["enqueued_at", "started_at", "ended_at"]:
+        if status[key] is not None:
+            status[key] = status[key].isoformat()
+    if status["state"] == "failed":
+        status["error"] = (job.exc_info or "").strip().splitlines()[-1:]
+    if status["state"] == "finished" and "reduce" in job.meta:
+        follow_run(job, status)
+
+    return status
+
+
+def follow_run(job, status):
+    """
+    Update the status of the split job of a distributed run, finished as
+    soon as its shards are queued, with the state of its shard and reduce
+    jobs. The run fails as soon as a shard fails.
+    """
+    shards = Job.fetch_many(job.meta["shards"], connection=job.connection)
+    # Expired shards finished long ago
+    states = [shard.get_status() if shard else "finished" for shard in shards]
+    status["shards"] = {
+        "total": len(states),
+        "finished": states.count("finished"),
+    }
+    failed = [
+        shard
+        for shard, state in zip(shards, states)
+        if state in ["failed", "stopped", "canceled"]
+    ]
+    try:
+        reducer = Job.fetch(job.meta["reduce"], connection=job.connection)
+    except NoSuchJobError:
+        return
+    state = reducer.get_status()
+    if failed:
+        status["state"] = "failed"
+        status["error"] = (failed[0].exc_info or "").strip().splitlines()[-1:]
+    elif state in ["deferred", "queued", "scheduled"]:
+        status["state"] = "started"
+        status["stage"] = "scan"
+        status["ended_at"] = None
+    else:
+        status["state"] = state
+        status["stage"] = reducer.meta.get("stage")
+        status["timings"].update(reducer.meta.get("timings", {}))
+        if reducer.ended_at is not None:
+            status["ended_at"] = reducer.ended_at.isoformat()
+        if state == "failed":
+            status["error"] = (
+                (reducer.exc_info or "").strip().splitlines()[-1:]
+            )
@@ -0,0 +1,121 @@
+"""Deferred report generation: donut plot and zip archive of results."""
+from checkpoint import CHECKPOINTS_FOLDER
+from collections import Counter
+import os
+import pathlib
+import zipfile
+
+
+PLOT = "superfamilies_distribution.png"
+
+
+def donut_graph(outdir, pngpath):
+    """
+    Make a donut graph from stats of predicted sequences.
+
+    Return False, without writing pngpath, when no sequence has a family
+    other than a CONFLICT to plot.
+    """
+    # Plotting libraries are only loaded when a plot is asked for
+    from matplotlib import pyplot as plt
+    import numpy as np
+    import pandas as pd
+
+    data = pd.read_table(pathlib.Path(outdir, "summary.txt"))
+    plot_data = data[data.columns[3]].tolist()
+    dtc = Counter(plot_data)
+    labels = [
+        f"{k1}: {v1}"
+        for k1, v1 in dtc.items()
+        if not k1.startswith("CONFLICT")
+    ]
+    values = [x for k2, x in dtc.items() if not k2.startswith("CONFLICT")]
+    if not values:
+        return False
+
+    # White circle
+    _, ax = plt.subplots(figsize=(8, 5), subplot_kw=dict(aspect="equal"))
+    wedges, _ = ax.pie(
+        np.array(values).ravel(),
+        wedgeprops=dict(width=0.5),
+        startangle=-40,
+    )
+
+    bbox_props = dict(boxstyle="square,pad = 0.3", fc="w", ec="k", lw=0.72)
+
+    kw = dict(
+        arrowprops=dict(arrowstyle="-"),
+        bbox=bbox_props,
+        zorder=0,
+        va="center",
+    )
+
+    for i, p in enumerate(wedges):
+        ang = (p.theta2 - p.theta1) / 2.0 + p.theta1
+        y = np.sin(np.deg2rad(ang))
+        x = np.cos(np.deg2rad(ang))
+        horizontalalignment = {-1: "right", 1: "left"}[int(np.sign(x))]
+        connectionstyle = f"angle, angleA = 0, angleB = {ang}"
+        kw["arrowprops"].update({"connectionstyle": connectionstyle})
+        ax.annotate(
+            labels[i],
+            xy=(x, y),
+            xytext=(1.35 * np.sign(x), 1.4 * y),
+            horizontalalignment=horizontalalignment,
+            **kw,
+        )
+
+    ax.set_title("ConoDictor Predictions")
+    plt.savefig(pngpath, format="png", dpi=300)
+    plt.close()
+
+    return True
+
+
+def build_plot(outdir):
+    """
+    Create the donut plot of outdir if missing and return its path, None
+    when there is nothing to plot.
+    """
+    pngpath = pathlib.Path(outdir, PLOT)
+    if not pngpath.exists():
+        # Write aside and rename so concurrent builds never expose a
+        # partial file
+        tmppath = pathlib.Path(outdir, f".{PLOT}.{os.getpid()}")
+        if not donut_graph(outdir, tmppath):
+            return None
+        os.replace(tmppath, pngpath)
+
+    return pngpath
+
+
+def build_archive(outdir):
+    """
+    Create the zip archive of outdir, plot included when there is one, if
+    missing and return its path. The checkpoints of the run are left out.
+    """
+    zippath = pathlib.Path(f"{outdir}.zip")
+    if not zippath.exists():
+        build_plot(outdir)
+        tmppath = f"{outdir}.{os.getpid()}.zip"
+        with zipfile.ZipFile(tmppath, "w", zipfile.ZIP_DEFLATED) as archive:
+            for dirpath, dirnames, filenames in os.walk(outdir):
+                if dirpath == str(outdir):
+                    dirnames[:] = [
+                        d for d in dirnames if d != CHECKPOINTS_FOLDER
+                    ]
+                for name in sorted(dirnames) + sorted(filenames):
+                    path = os.path.join(dirpath, name)
+                    archive.write(path, os.path.relpath(path, outdir))
+        os.replace(tmppath, zippath)
+
+    return zippath
+
+
+def build_reports(outdir):
+    """
+    Create every missing report of outdir. Used as a low priority job
+    queued after the classification job.
+    """
+    build_plot(outdir)
+    build_archive(outdir)
@@ -3,8 +3,10 @@ import urllib.parse
 from redis import Redis
 from rq import Queue, Connection
 from rq.worker import HerokuWorker as Worker
+from runtime import init_context, preload
+from scheduler import QUEUES
 
-listen = ["high", "default", "low"]
+listen = QUEUES
 
 redis_url = os.getenv("REDISTOGO_URL")
 if not redis_url:
@@ -15,6 +17,11 @@ url = urllib.parse.urlparse(redis_url)
 conn = Redis(host=url.hostname, port=url.port, db=0, password=url.password)
 
 if __name__ == "__main__":
+    # Probe tools, check databases and import the analysis stack once, jobs
+    # inherit them when forked
+    init_context()
+    preload()
     with Connection(conn):
         worker = Worker(map(Queue, listen))
-        worker.work()
+        # The scheduler queues failed jobs again once their retry is due
+        worker.work(with_scheduler=True)
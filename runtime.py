@@ -0,0 +1,129 @@
+"""Worker runtime context shared by every conodictor job."""
+import hashlib
+import importlib
+import os
+import pathlib
+import re
+import subprocess
+
+
+DBDIR = pathlib.Path(os.path.dirname(os.path.realpath(__file__)), "db")
+
+# Modules of the jobs, imported by the workers only
+JOB_MODULES = [
+    "conodictor",
+    "distributed",
+    "batch",
+    "fastpath",
+    "reports",
+    "matplotlib.pyplot",
+]
+
+_context = None
+
+
+def probe_version(cmd, pattern):
+    """
+    Run a tool help command and extract its version with pattern.
+    """
+    try:
+        run = subprocess.run(cmd, capture_output=True)
+    except FileNotFoundError:
+        raise RuntimeError(f"{cmd[0]} was not found in PATH")
+    match = re.findall(pattern, run.stdout.decode("utf-8"))
+    if not match:
+        raise RuntimeError(f"Unable to read {cmd[0]} version")
+
+    return match[0]
+
+
+def checksum(path):
+    """
+    sha256 of a file content.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def db_hash(dbdir):
+    """
+    Hash conodictor.hmm and conodictor.pssm so cache entries are dropped
+    whenever a database changes.
+    """
+    h = hashlib.sha256()
+    for name in ["conodictor.hmm", "conodictor.pssm"]:
+        with open(pathlib.Path(dbdir, name), "rb") as dbfile:
+            for block in iter(lambda: dbfile.read(1 << 20), b""):
+                h.update(block)
+
+    return h.hexdigest()
+
+
+class RuntimeContext(object):
+    """
+    Tool versions and checked databases, set up once per worker.
+
+    Arguments:
+    - dbdir - directory of conodictor.hmm and conodictor.pssm
+    """
+
+    def __init__(self, dbdir=DBDIR):
+        self.dbdir = pathlib.Path(dbdir)
+        self.hmmdb = pathlib.Path(self.dbdir, "conodictor.hmm")
+        self.pssmdb = pathlib.Path(self.dbdir, "conodictor.pssm")
+
+        self.hmmsearch_version = probe_version(
+            ["hmmsearch", "-h"], r"# HMMER\s+(\d+\.\d+)"
+        )
+        self.pfscan_version = probe_version(
+            ["pfscanV3", "-h"], r"Version\s+(\d+\.\d+\.\d+)"
+        )
+
+        with open(self.hmmdb) as hmmfile:
+            if not hmmfile.readline().startswith("HMMER3"):
+                raise RuntimeError(f"{self.hmmdb} is not a HMMER3 database")
+        with open(self.pssmdb) as pssmfile:
+            if not pssmfile.readline().startswith("ID "):
+                raise RuntimeError(f"{self.pssmdb} is not a PROSITE profile")
+
+        self.checksums = {
+            self.hmmdb.name: checksum(self.hmmdb),
+            self.pssmdb.name: checksum(self.pssmdb),
+        }
+        self.dbhash = db_hash(self.dbdir)
+        # Built once next to the database, then mapped by every job
+        from prefilter import load_index, MIN_KMERS
+
+        self.prefilter = load_index(str(self.hmmdb)) if MIN_KMERS else None
+
+
+def init_context(dbdir=DBDIR):
+    """
+    Set up the runtime context of this process. Call it in the worker main
+    process before jobs are forked so that every job inherits it.
+    """
+    global _context
+    _context = RuntimeContext(dbdir)
+
+    return _context
+
+
+def preload(modules=JOB_MODULES):
+    """
+    Import the analysis stack of the jobs. Call it in the worker main
+    process so that every forked job shares it copy-on-write instead of
+    importing it again.
+    """
+    for name in modules:
+        importlib.import_module(name)
+
+
+def get_context():
+    """
+    Return the runtime context of this process, set up on first use.
+    """
+    return _context or init_context()
@@ -0,0 +1,120 @@
+"""Size-aware routing of conodictor jobs to RQ queues."""
+from alphabet import alphabet_report, classify_records, parse_fasta
+import gzip
+import os
+
+
+# Queues by decreasing priority, workers listen to them in this order
+QUEUES = ["fast", "high", "default", "low"]
+CHUNK = 1 << 22
+
+
+def is_gzip(path):
+    """
+    Test gzip magic number of a file.
+    """
+    with open(path, "rb") as fh:
+        return fh.read(2) == b"\x1f\x8b"
+
+
+def estimate_job(path):
+    """
+    Estimate the size of a fasta file, gzipped or not.
+
+    Argument:
+    - path - DNA or protein fasta file, required (str)
+
+    Return a dict with the number of sequences, of residues and the
+    sequence type found in the first records. Plain files are counted in
+    full; gzipped files are counted on their first chunk and extrapolated
+    from the compression ratio, so that big uploads are not decompressed
+    in the request.
+    """
+    size = os.path.getsize(path)
+    nseqs = newlines = total = 0
+    if is_gzip(path):
+        with open(path, "rb") as raw:
+            with gzip.GzipFile(fileobj=raw) as fh:
+                head = fh.read(CHUNK)
+                ratio = size / max(raw.tell(), 1)
+        nseqs = head.count(b">") * ratio
+        newlines = head.count(b"\n") * ratio
+        total = len(head) * ratio
+    else:
+        with open(path, "rb") as fh:
+            head = fh.read(CHUNK)
+            chunk = head
+            while chunk:
+                nseqs += chunk.count(b">")
+                newlines += chunk.count(b"\n")
+                total += len(chunk)
+                chunk = fh.read(CHUNK)
+
+    # Drop the last record of the first chunk, it may be truncated
+    records = list(parse_fasta(head))
+    if len(records) > 1 and len(head) == CHUNK:
+        records = records[:-1]
+    report = alphabet_report(classify_records(records))
+
+    return {
+        "sequences": int(nseqs) or 1,
+        "residues": int(total - newlines),
+        "type": report["type"],
+    }
+
+
+def estimate_text(text):
+    """
+    Estimate the size of pasted sequences like estimate_job.
+    """
+    classified = []
+    residues = 0
+    for name, seq in parse_fasta(text):
+        residues += len(seq)
+        classified.append(next(classify_records([(name, seq)])))
+
+    return {
+        "sequences": len(classified),
+        "residues": residues,
+        "type": alphabet_report(classified)["type"],
+    }
+
+
+def job_cost(estimate):
+    """
+    Number of protein residues to scan for a job, six frames of a third of
+    the length for DNA.
+    """
+    if estimate["type"] == "DNA":
+        return estimate["residues"] * 2
+    return estimate["residues"]
+
+
+def route_job(estimate, config, pasted=False):
+    """
+    Choose the queue and timeout of a job.
+
+    Arguments:
+    - estimate - job size as given by estimate_job, required (dict)
+    - config   - app configuration with the SCHEDULER_* keys, required
+    - pasted   - job comes from the sequence text box (bool)
+
+    Return the queue name and the job timeout in seconds, both scaled to
+    the job cost.
+    """
+    cost = job_cost(estimate)
+
+    if pasted and cost <= config["SCHEDULER_FAST_RESIDUES"]:
+        queue = "fast"
+    elif cost <= config["SCHEDULER_HIGH_RESIDUES"]:
+        queue = "high"
+    elif cost <= config["SCHEDULER_DEFAULT_RESIDUES"]:
+        queue = "default"
+    else:
+        queue = "low"
+
+    timeout = config["SCHEDULER_BASE_TIMEOUT"] + int(
+        cost * config["SCHEDULER_SECONDS_PER_RESIDUE"]
+    )
+
+    return queue, min(timeout, config["SCHEDULER_MAX_TIMEOUT"])
@@ -0,0 +1,326 @@
+"""HMM and PSSM scanning of protein sequences."""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import hashlib
+import heapq
+import os
+import pathlib
+import pyfastx
+import shutil
+import subprocess
+import tempfile
+import time
+
+
+def shard_fasta(inpath, nshards, sharddir):
+    """
+    Split a protein fasta file in chunks of balanced residue count.
+
+    Arguments:
+    - inpath   - protein fasta file, required (str)
+    - nshards  - maximum number of chunks, required (int)
+    - sharddir - directory where chunks are written, required (str)
+
+    Return the list of chunk paths. Sequences are assigned longest first to
+    the chunk with the fewest residues so far.
+    """
+    fa = pyfastx.Fasta(str(inpath))
+    nshards = max(1, min(nshards, len(fa)))
+    bins = [(0, i) for i in range(nshards)]
+    assign = {}
+    for name, length in sorted(
+        ((s.name, len(s)) for s in fa), key=lambda x: x[1], reverse=True
+    ):
+        residues, idx = heapq.heappop(bins)
+        assign[name] = idx
+        heapq.heappush(bins, (residues + length, idx))
+
+    os.makedirs(sharddir, exist_ok=True)
+    paths = [pathlib.Path(sharddir, f"shard_{i}.fa") for i in range(nshards)]
+    handles = [open(p, "w") for p in paths]
+    try:
+        for name, seq in pyfastx.Fasta(str(inpath), build_index=False):
+            handles[assign[name]].write(f">{name}\n{seq}\n")
+    finally:
+        for handle in handles:
+            handle.close()
+
+    return paths
+
+
+def dedup_fasta(inpath, outpath):
+    """
+    Keep the first record of each distinct protein sequence.
+
+    Arguments:
+    - inpath  - protein fasta file, required (str)
+    - outpath - file where unique sequences are written, required (str)
+
+    Return a dict of the ids of the dropped duplicates by id of the kept
+    record, for kept records that have duplicates only. Sequences are
+    compared by hash, case insensitive. outpath is only written when there
+    are duplicates, inpath is scanned as is otherwise.
+    """
+    kept = {}
+    dups = defaultdict(list)
+    dropped = set()
+    for idx, (name, seq) in enumerate(
+        pyfastx.Fasta(str(inpath), build_index=False)
+    ):
+        digest = hashlib.blake2b(
+            seq.upper().encode("ascii"), digest_size=16
+        ).digest()
+        if digest in kept:
+            dups[kept[digest]].append(name)
+            dropped.add(idx)
+        else:
+            kept[digest] = name
+
+    if dups:
+        with open(outpath, "w") as outfile:
+            for idx, (name, seq) in enumerate(
+                pyfastx.Fasta(str(inpath), build_index=False)
+            ):
+                if idx not in dropped:
+                    outfile.write(f">{name}\n{seq}\n")
+
+    return dups
+
+
+def fan_out(hmmdict, pssmdict, dups):
+    """
+    Give the HMM and PSSM hits of each kept sequence to its duplicates, as
+    found by dedup_fasta.
+    """
+    for name, others in dups.items():
+        for other in others:
+            if name in hmmdict:
+                hmmdict[other] = hmmdict[name]
+            if name in pssmdict:
+                pssmdict[other] = pssmdict[name]
+
+
+def parse_tblout(handle, hmmdict=None):
+    """
+    Read hmmsearch --tblout lines and collect hits e-values.
+
+    Arguments:
+    - handle  - iterable of tblout lines, required (file or pipe)
+    - hmmdict - dict to fill, created if not given
+
+    Return a dict of full sequence e-values by family for each sequence id.
+    Lines are consumed one at a time, only target, query and e-value
+    columns are read.
+    """
+    if hmmdict is None:
+        hmmdict = defaultdict(lambda: defaultdict(list))
+    for line in handle:
+        if line.startswith("#"):
+            continue
+        fields = line.split(None, 5)
+        if len(fields) < 5:
+            continue
+        hmmdict[fields[0]][fields[2].split("_")[1]].append(float(fields[4]))
+
+    return hmmdict
+
+
+def tee(lines, rawfile=None):
+    """
+    Yield lines from a pipe, copying them to rawfile when given.
+    """
+    if rawfile is None:
+        yield from lines
+        return
+    with open(rawfile, "w") as raw:
+        for line in lines:
+            raw.write(line)
+            yield line
+
+
+def check_run(run, errfile):
+    """
+    Raise CalledProcessError, with the standard error of the tool, when a
+    tool run failed rather than reading its partial output as no hits.
+    """
+    if run.returncode:
+        errfile.seek(0)
+        raise subprocess.CalledProcessError(
+            run.returncode,
+            run.args,
+            stderr=errfile.read().decode("utf-8", "replace"),
+        )
+
+
+def hmm_search(inpath, hmmdb, nseqs, rawfile=None):
+    """
+    Run hmmsearch on a protein fasta file and collect hits e-values.
+
+    Arguments:
+    - inpath  - protein fasta file, required (str)
+    - hmmdb   - HMM database, required (str)
+    - nseqs   - total number of sequences searched, used to keep e-values
+                identical whether the input is sharded or not (int)
+    - rawfile - file where the tabular output is kept for debugging (str)
+
+    Return a dict of e-values by family for each sequence id. The tabular
+    output is parsed from a pipe while hmmsearch runs. Raise
+    CalledProcessError when hmmsearch fails.
+    """
+    # A file, not a pipe, that cannot fill up while stdout is read
+    with tempfile.TemporaryFile() as errfile:
+        with subprocess.Popen(
+            [
+                "hmmsearch",
+                "--cpu",
+                "1",
+                "-Z",
+                str(nseqs),
+                "-E",
+                "0.1",
+                "--noali",
+                "-o",
+                os.devnull,
+                "--tblout",
+                "/dev/stdout",
+                hmmdb,
+                inpath,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=errfile,
+            universal_newlines=True,
+        ) as hmm_run:
+            hmmdict = parse_tblout(tee(hmm_run.stdout, rawfile))
+        check_run(hmm_run, errfile)
+
+    return hmmdict
+
+
+def pssm_scan(inpath, pssmdb, rawfile=None):
+    """
+    Run pfscanV3 on a protein fasta file and collect matched families.
+
+    Arguments:
+    - inpath  - protein fasta file, required (str)
+    - pssmdb  - PSSM database, required (str)
+    - rawfile - file where the output is kept for debugging (str)
+
+    Return a dict of matched families for each sequence id. The output is
+    parsed from a pipe while pfscanV3 runs. Raise CalledProcessError when
+    pfscanV3 fails.
+    """
+    pssmdict = defaultdict(list)
+    with tempfile.TemporaryFile() as errfile:
+        with subprocess.Popen(
+            ["pfscanV3", "-o", "7", pssmdb, "-f", inpath],
+            stdout=subprocess.PIPE,
+            stderr=errfile,
+            universal_newlines=True,
+        ) as pssm_run:
+            rd = csv.reader(tee(pssm_run.stdout, rawfile), delimiter="\t")
+            for row in rd:
+                pssmdict[row[3]].append((row[0].split("|")[0]).split("_")[1])
+        check_run(pssm_run, errfile)
+
+    return pssmdict
+
+
+def timed(func, *args):
+    """
+    Call func and return its result with its walltime in seconds.
+    """
+    start = time.perf_counter()
+    result = func(*args)
+
+    return result, time.perf_counter() - start
+
+
+def parallel_scan(
+    inpath,
+    dbdir,
+    outdir,
+    nseqs,
+    workers=None,
+    keep_raw=False,
+    timings=None,
+    scans=("hmm", "pssm"),
+    done=None,
+):
+    """
+    Run HMM and PSSM scans concurrently over shards of a protein file.
+
+    Arguments:
+    - inpath   - protein fasta file, required (str)
+    - dbdir    - directory of conodictor.hmm and conodictor.pssm, required
+    - outdir   - directory where shards and raw outputs are written, required
+    - nseqs    - number of sequences in inpath, required (int)
+    - workers  - number of concurrent tool runs, default to the cpu count
+    - keep_raw - keep tools outputs as out.hmmer.N and out.pssm.N (bool)
+    - timings  - dict where the hmmsearch and pfscan walltimes, summed over
+                 shards and parsing included, are added (dict)
+    - scans    - scans to run, "hmm" and or "pssm" (tuple)
+    - done     - function called with the scan name and its merged results
+                 as soon as every shard of the scan is done
+
+    Return the merged hmmdict and pssmdict, empty for scans not run.
+    """
+    timings = {} if timings is None else timings
+    workers = workers or os.cpu_count() or 1
+    hmmdb = pathlib.Path(dbdir, "conodictor.hmm")
+    pssmdb = pathlib.Path(dbdir, "conodictor.pssm")
+
+    # HMM and PSSM jobs share the pool, so each stage gets half the shards
+    nshards = max(1, workers // len(scans))
+    if nshards > 1:
+        shards = shard_fasta(inpath, nshards, pathlib.Path(outdir, "shards"))
+    else:
+        shards = [pathlib.Path(inpath)]
+
+    hmmdict = defaultdict(lambda: defaultdict(list))
+    pssmdict = defaultdict(list)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        hmm_jobs = [
+            pool.submit(
+                timed,
+                hmm_search,
+                shard,
+                hmmdb,
+                nseqs,
+                pathlib.Path(outdir, f"out.hmmer.{i}") if keep_raw else None,
+            )
+            for i, shard in enumerate(shards)
+            if "hmm" in scans
+        ]
+        pssm_jobs = [
+            pool.submit(
+                timed,
+                pssm_scan,
+                shard,
+                pssmdb,
+                pathlib.Path(outdir, f"out.pssm.{i}") if keep_raw else None,
+            )
+            for i, shard in enumerate(shards)
+            if "pssm" in scans
+        ]
+        for job in hmm_jobs:
+            result, seconds = job.result()
+            timings["hmmsearch"] = timings.get("hmmsearch", 0) + seconds
+            for seqid, fams in result.items():
+                for fam, evalues in fams.items():
+                    hmmdict[seqid][fam].extend(evalues)
+        if done and hmm_jobs:
+            done("hmm", hmmdict)
+        for job in pssm_jobs:
+            result, seconds = job.result()
+            timings["pfscan"] = timings.get("pfscan", 0) + seconds
+            for seqid, fams in result.items():
+                pssmdict[seqid].extend(fams)
+        if done and pssm_jobs:
+            done("pssm", pssmdict)
+
+    if nshards > 1:
+        # Along with shards left by an interrupted attempt of the run
+        shutil.rmtree(pathlib.Path(outdir, "shards"))
+
+    return hmmdict, pssmdict
@@ -0,0 +1,49 @@
+"""HMM e-values of the result cache, read back by jobs of any size."""
+from cache import ResultCache
+from decision import hmm_families
+import random
+import sqlite3
+
+
+def test_same_size_reads_stored_evalues(tmp_path):
+    rng = random.Random(0)
+    results = {}
+    for idx in range(1000):
+        evalue = float(f"{rng.uniform(1, 9.9):.1f}e-{rng.randint(5, 40):02d}")
+        results[f"key{idx}"] = ({"A": [evalue], "M": [evalue * 100]}, [])
+    cache = ResultCache(tmp_path / "cache.db", "dbhash")
+    cache.put(results, 7919)
+
+    found = cache.get(results, 7919)
+
+    assert found == results
+    # Second family exactly 100 times the best one is a conflict
+    assert set(hmm_families({k: v[0] for k, v in found.items()})) == {
+        "CONFLICT A and M"
+    }
+
+
+def test_other_size_rescales_evalues(tmp_path):
+    cache = ResultCache(tmp_path / "cache.db", "dbhash")
+    cache.put({"key": ({"A": [1e-3, 0.06]}, ["A"])}, 1000)
+
+    assert cache.get(["key"], 2000) == {"key": ({"A": [2e-3]}, ["A"])}
+    # Computed on a larger job, hits of a smaller one may be missing
+    assert cache.get(["key"], 500) == {}
+
+
+def test_former_pvalues_are_dropped(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "cache.db"))
+    conn.execute(
+        "CREATE TABLE results (key TEXT PRIMARY KEY, nseqs INTEGER,"
+        + " hmm TEXT, pssm TEXT, last_used REAL)"
+    )
+    conn.execute(
+        "INSERT INTO results VALUES ('key', 10, '{\"A\": [1e-05]}', '[]', 0)"
+    )
+    conn.commit()
+    conn.close()
+
+    cache = ResultCache(tmp_path / "cache.db", "dbhash")
+
+    assert cache.get(["key"], 10) == {}
@@ -0,0 +1,223 @@
+"""Equivalence of decision.py with the family decision of conodictor 2.1.
+
+The former functions are kept below as they were nested in conodictor(),
+only cdpred is fixed: both labels CONFLICT raised TypeError there, on a
+stray unary + before the second half of its f-string.
+"""
+from collections import Counter, defaultdict
+from decision import (
+    cdpred,
+    hmm_families,
+    pssm_families,
+    summarize,
+    write_summary,
+)
+from functools import reduce
+from heapq import nsmallest
+from operator import mul
+import pytest
+import random
+import re
+
+
+FAMILIES = "A B1 B2 B4 C D E F G H I1 I2 I3 J K L M N O1 O2 O3 P Q R S T U V"
+# Few distinct e-values so that products tie
+EVALUES = [0.0, 1e-30, 2.5e-12, 3e-8, 1e-5, 0.001, 0.04, 0.5]
+
+
+def former_cdpred(hmmclass, pssmclass):
+    deffam = None
+
+    if hmmclass == pssmclass:
+        deffam = hmmclass
+    elif "CONFLICT" in pssmclass and "CONFLICT" in hmmclass:
+        fams_pssm = re.search("(?<=CONFLICT)(.*)and(.*)", pssmclass)
+        fams_hmm = re.search("(?<=CONFLICT)(.*)and(.*)", hmmclass)
+        deffam = (
+            f"CONFLICT {fams_pssm.group(1)}, {fams_pssm.group(2)},"
+            + f" {fams_hmm.group(1)}, and {fams_hmm.group(2)}"
+        )
+    elif "CONFLICT" in pssmclass and "CONFLICT" not in hmmclass:
+        deffam = hmmclass
+    elif "CONFLICT" in hmmclass and "CONFLICT" not in pssmclass:
+        deffam = pssmclass
+    elif pssmclass != hmmclass:
+        deffam = f"CONFLICT {hmmclass} and {pssmclass}"
+
+    return deffam
+
+
+def former_get_pssm_fam(mdict):
+    fam = ""
+    pssmfam = {}
+    for key in mdict.keys():
+        x = Counter(mdict[key])
+        # Take the top 2 item with highest count in list
+        possible_fam = x.most_common(2)
+
+        if len(possible_fam) == 1:
+            fam = possible_fam[0][0]
+        elif len(possible_fam) > 1:
+            if possible_fam[0][1] == possible_fam[1][1]:
+                fam = (
+                    f"CONFLICT {possible_fam[0][0]}"
+                    + f" and {possible_fam[1][0]}"
+                )
+            elif possible_fam[0][1] > possible_fam[1][1]:
+                fam = possible_fam[0][0]
+            else:
+                fam = possible_fam[1][0]
+
+        pssmfam[key] = fam
+
+    return pssmfam
+
+
+def former_hmm_threshold(mdict):
+    score = defaultdict(dict)
+    for key in mdict.keys():
+        for k, v in mdict[key].items():
+            score[key][k] = reduce(mul, v, 1)
+
+    return score
+
+
+def former_get_hmm_fam(mdict):
+    conofam = ""
+    seqfam = {}
+    for key in mdict.keys():
+        two_smallest = nsmallest(2, mdict[key].values())
+
+        if len(two_smallest) == 1:
+            conofam = next(iter(mdict[key]))
+        elif two_smallest[0] * 100 != two_smallest[1]:
+            conofam = list(mdict[key].keys())[
+                list(mdict[key].values()).index(two_smallest[0])
+            ]
+        elif two_smallest[0] * 100 == two_smallest[1]:
+            fam1 = list(mdict[key].keys())[
+                list(mdict[key].values()).index(two_smallest[0])
+            ]
+            fam2 = list(mdict[key].keys())[
+                list(mdict[key].values()).index(two_smallest[1])
+            ]
+            conofam = f"CONFLICT {fam1} and {fam2}"
+
+        seqfam[key] = conofam
+
+    return seqfam
+
+
+def former_summary(seqids, hmmdict, pssmdict, allres=False):
+    """
+    summary.txt text of conodictor 2.1 for the given scan results.
+    """
+    hmmfam = former_get_hmm_fam(former_hmm_threshold(hmmdict))
+    pssmfam = former_get_pssm_fam(pssmdict)
+    finalfam = defaultdict(list)
+    for sid in seqids:
+        if sid in hmmfam and sid in pssmfam:
+            finalfam[sid].extend(
+                [
+                    hmmfam[sid],
+                    pssmfam[sid],
+                    former_cdpred(hmmfam[sid], pssmfam[sid]),
+                ]
+            )
+        elif sid in hmmfam and sid not in pssmfam:
+            finalfam[sid].extend([hmmfam[sid], "UNKNOWN", hmmfam[sid]])
+        elif sid in pssmfam and sid not in hmmfam:
+            finalfam[sid].extend(["UNKNOWN", pssmfam[sid], pssmfam[sid]])
+        else:
+            finalfam[sid].extend(["UNKOWN", "UNKOWN", "UNKNOWN"])
+
+    lines = ["sequence\thmm_pred\tpssm_pred\tdefinitive_pred\n"]
+    for k, v in finalfam.items():
+        if allres or not set(v).intersection(["UNKNOWN"]):
+            lines.append(f"{k}\t{v[0]}\t{v[1]}\t{v[2]}\n")
+
+    return "".join(lines)
+
+
+def make_results(rng, size):
+    """
+    Random scan results of size sequences: sequence ids in output order,
+    e-values by family of each HMM hit and families of each PSSM match.
+
+    Ties on e-value products and on PSSM counts are frequent, and some
+    sequences have a second family exactly 100 times the best product.
+    """
+    families = FAMILIES.split()
+    seqids = [f"seq{i}_frame={rng.randint(1, 6)}" for i in range(size)]
+    hmmdict, pssmdict = {}, {}
+    for sid in rng.sample(seqids, rng.randint(0, size)):
+        famdict = {}
+        for fam in rng.sample(families, rng.randint(1, 4)):
+            famdict[fam] = [rng.choice(EVALUES) for _ in range(3)]
+        if len(famdict) > 1 and rng.random() < 0.2:
+            best, other = list(famdict)[:2]
+            famdict[best] = [rng.choice(EVALUES[1:])]
+            famdict[other] = [famdict[best][0] * 100]
+        hmmdict[sid] = famdict
+    for sid in rng.sample(seqids, rng.randint(0, size)):
+        pool = rng.sample(families, rng.randint(1, 3))
+        pssmdict[sid] = [rng.choice(pool) for _ in range(rng.randint(1, 6))]
+
+    return seqids, hmmdict, pssmdict
+
+
+def columnar_summary(seqids, hmmdict, pssmdict, allres, path):
+    """
+    summary.txt text written by decision.py for the given scan results.
+    """
+    summary = summarize(
+        seqids, hmm_families(hmmdict), pssm_families(pssmdict), allres
+    )
+    write_summary(summary, path)
+    with open(path) as summaryfile:
+        return summaryfile.read()
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_families_match_former(seed):
+    _, hmmdict, pssmdict = make_results(random.Random(seed), 50)
+
+    hmmfam = former_get_hmm_fam(former_hmm_threshold(hmmdict))
+    pssmfam = former_get_pssm_fam(pssmdict)
+
+    assert hmm_families(hmmdict).to_dict() == hmmfam
+    assert pssm_families(pssmdict).to_dict() == pssmfam
+
+
+@pytest.mark.parametrize("allres", [False, True])
+@pytest.mark.parametrize("seed", range(300))
+def test_summary_matches_former(seed, allres, tmp_path):
+    seqids, hmmdict, pssmdict = make_results(random.Random(seed), 50)
+
+    assert columnar_summary(
+        seqids, hmmdict, pssmdict, allres, tmp_path / "summary.txt"
+    ) == former_summary(seqids, hmmdict, pssmdict, allres)
+
+
+@pytest.mark.parametrize(
+    "hmmclass, pssmclass",
+    [
+        ("A", "A"),
+        ("A", "M"),
+        ("CONFLICT A and M", "O1"),
+        ("O1", "CONFLICT A and M"),
+        ("CONFLICT A and M", "CONFLICT B1 and T"),
+        ("CONFLICT I1 and D", "CONFLICT D and I1"),
+    ],
+)
+def test_cdpred_matches_former(hmmclass, pssmclass):
+    assert cdpred(hmmclass, pssmclass) == former_cdpred(hmmclass, pssmclass)
+
+
+def test_empty_results(tmp_path):
+    seqids = ["seq1", "seq2"]
+
+    for allres in [False, True]:
+        assert columnar_summary(
+            seqids, {}, {}, allres, tmp_path / f"summary{allres}.txt"
+        ) == former_summary(seqids, {}, {}, allres)
@@ -0,0 +1,93 @@
+"""Equivalence of translation.py with the translation of conodictor 2.1.
+
+The former functions are kept below as they were nested in conodictor().
+"""
+from Bio.Seq import reverse_complement, translate
+from itertools import islice
+import pathlib
+import pyfastx
+import pytest
+import random
+from translation import translate_records
+import warnings
+
+
+# IUPAC codes, ambiguous ones rare, both cases and RNA
+BASES = "ACGT" * 20 + "acgtRYSWKMBDHVNU"
+
+
+def former_translate_seq(seq):
+    seqlist = []
+    # frame 1
+    seqlist.append(translate(seq))
+    # frame 2
+    seqlist.append(translate(seq[1:]))
+    # frame 3
+    seqlist.append(translate(seq[2:]))
+    # frame 4
+    seqlist.append(translate(reverse_complement(seq)))
+    # frame 5
+    seqlist.append(translate(reverse_complement(seq)[1:]))
+    # frame 6
+    seqlist.append(translate(reverse_complement(seq)[2:]))
+
+    return seqlist
+
+
+def former_do_translation(infile, outfile, sw=60):
+    seqin = pyfastx.Fasta(str(infile))
+    with open(pathlib.Path(f"{outfile}_proteins.fa"), "w") as protfile:
+        for sequence in seqin:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                protseq = former_translate_seq(sequence.seq)
+                for idx, frame in enumerate(protseq):
+                    seq_letters = [
+                        frame[i : i + sw]  # noqa: E203
+                        for i in range(0, len(frame), sw)
+                    ]
+                    nl = "\n"
+                    protfile.write(
+                        f">{sequence.name}_frame={idx + 1}\n"
+                        + f"{nl.join(map(str, seq_letters))}\n"
+                    )
+
+
+def engine_translation(infile, outfile, sw=60, batch_size=1000):
+    """
+    Translate infile to {outfile}_proteins.fa with translation.py, batch by
+    batch as inputs.read_input does.
+    """
+    # pyfastx restarts from the top of the file on each iter() call
+    fasta = pyfastx.Fasta(str(infile), build_index=False)
+    records = (rec for rec in fasta)
+    with open(pathlib.Path(f"{outfile}_proteins.fa"), "wb") as protfile:
+        batch = list(islice(records, batch_size))
+        while batch:
+            protfile.write(translate_records(batch, sw))
+            batch = list(islice(records, batch_size))
+
+
+def make_contigs(rng, size, path):
+    """
+    Write size random contigs of 1 to 500 nucleotides to path.
+    """
+    with open(path, "w") as fasta:
+        for idx in range(size):
+            length = rng.randint(1, 500)
+            seq = "".join(rng.choice(BASES) for _ in range(length))
+            fasta.write(f">contig{idx}\n{seq}\n")
+
+
+@pytest.mark.parametrize("sw", [60, 7])
+@pytest.mark.parametrize("seed", range(20))
+def test_translation_matches_former(seed, sw, tmp_path):
+    infile = tmp_path / "contigs.fa"
+    make_contigs(random.Random(seed), 50, infile)
+
+    former_do_translation(infile, tmp_path / "former", sw)
+    engine_translation(infile, tmp_path / "engine", sw, batch_size=16)
+
+    assert (tmp_path / "engine_proteins.fa").read_bytes() == (
+        tmp_path / "former_proteins.fa"
+    ).read_bytes()
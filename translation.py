@@ -0,0 +1,224 @@
+"""Six-frame translation engine working on byte buffers."""
+from Bio.Data.CodonTable import standard_dna_table
+from itertools import product
+import numpy as np
+
+
+# IUPAC nucleotide codes and the bases each of them stands for. Each code is
+# mapped to a small integer so that a codon can be used as an index in a
+# precomputed lookup table of 15 ** 3 entries. Unknown letters read as N.
+IUPAC = {
+    "A": "A",
+    "C": "C",
+    "G": "G",
+    "T": "T",
+    "R": "AG",
+    "Y": "CT",
+    "S": "CG",
+    "W": "AT",
+    "K": "GT",
+    "M": "AC",
+    "B": "CGT",
+    "D": "AGT",
+    "H": "ACT",
+    "V": "ACG",
+    "N": "ACGT",
+}
+COMPLEMENT = {
+    "A": "T",
+    "C": "G",
+    "G": "C",
+    "T": "A",
+    "R": "Y",
+    "Y": "R",
+    "S": "S",
+    "W": "W",
+    "K": "M",
+    "M": "K",
+    "B": "V",
+    "D": "H",
+    "H": "D",
+    "V": "B",
+    "N": "N",
+}
+CODES = list(IUPAC.keys())
+# Shortest ORF kept, in amino acids. Conopeptide precursors are roughly 60
+# to 120 residues long, signal peptide included.
+MIN_ORF = 30
+AMBIGUOUS_AA = {
+    frozenset("DN"): "B",
+    frozenset("EQ"): "Z",
+    frozenset("IL"): "J",
+}
+
+
+def _build_tables():
+    """
+    Build byte-to-code, code complement and codon-to-aminoacid tables.
+    """
+    encode = np.full(256, CODES.index("N"), dtype=np.uint8)
+    for idx, base in enumerate(CODES):
+        encode[ord(base)] = idx
+        encode[ord(base.lower())] = idx
+    encode[ord("U")] = encode[ord("u")] = CODES.index("T")
+
+    complement = np.arange(len(CODES), dtype=np.uint8)
+    for base, comp in COMPLEMENT.items():
+        complement[CODES.index(base)] = CODES.index(comp)
+
+    # Ambiguous codons translate to the amino acid (or stop) shared by every
+    # codon they expand to, to B, Z or J when they only expand to D/N, E/Q or
+    # I/L, and to X otherwise, like Bio.Seq.translate.
+    forward = standard_dna_table.forward_table
+    stops = set(standard_dna_table.stop_codons)
+    codon_table = np.full(len(CODES) ** 3, ord("X"), dtype=np.uint8)
+    for b1, b2, b3 in product(IUPAC.keys(), repeat=3):
+        aas = set()
+        for codon in product(IUPAC[b1], IUPAC[b2], IUPAC[b3]):
+            codon = "".join(codon)
+            aas.add("*" if codon in stops else forward[codon])
+        aa = AMBIGUOUS_AA.get(frozenset(aas))
+        if len(aas) == 1:
+            aa = aas.pop()
+        if aa is not None:
+            idx = (
+                CODES.index(b1) * len(CODES) ** 2
+                + CODES.index(b2) * len(CODES)
+                + CODES.index(b3)
+            )
+            codon_table[idx] = ord(aa)
+
+    return encode, complement, codon_table
+
+
+ENCODE, COMPLEMENT_CODE, CODON_TABLE = _build_tables()
+
+
+def _translate_codes(codes):
+    """
+    Translate an array of nucleotide codes in frame 1 and return bytes.
+    """
+    n = len(codes) // 3
+    codons = codes[: n * 3].reshape(n, 3).astype(np.uint16)
+    idx = codons[:, 0] * len(CODES) ** 2
+    idx += codons[:, 1] * len(CODES)
+    idx += codons[:, 2]
+
+    return CODON_TABLE[idx].tobytes()
+
+
+def six_frames(seq):
+    """
+    Translate a DNA sequence in its six frames.
+
+    Arguments:
+    - seq - DNA sequence, required (str or bytes)
+
+    Return a list of six protein sequences as bytes, in the same order as
+    frames 1 to 6 of the former translate_seq.
+    """
+    if isinstance(seq, str):
+        seq = seq.encode("ascii")
+    codes = ENCODE[np.frombuffer(seq, dtype=np.uint8)]
+    # Compute reverse complement only once for frames 4, 5 and 6
+    revcodes = COMPLEMENT_CODE[codes[::-1]]
+
+    return [
+        _translate_codes(codes),
+        _translate_codes(codes[1:]),
+        _translate_codes(codes[2:]),
+        _translate_codes(revcodes),
+        _translate_codes(revcodes[1:]),
+        _translate_codes(revcodes[2:]),
+    ]
+
+
+def wrap(seq, sw=60):
+    """
+    Wrap a bytes sequence in lines of sw letters.
+    """
+    return b"\n".join(
+        seq[i : i + sw] for i in range(0, len(seq), sw)  # noqa: E203
+    )
+
+
+def translate_records(records, sw=60):
+    """
+    Translate (name, seq) records and return the FASTA text as bytes.
+    """
+    chunks = []
+    for name, seq in records:
+        for idx, frame in enumerate(six_frames(seq)):
+            chunks.append(
+                b">%s_frame=%d\n%s\n"
+                % (name.encode("utf-8"), idx + 1, wrap(frame, sw))
+            )
+
+    return b"".join(chunks)
+
+
+def find_orfs(protein, min_length=MIN_ORF, met=False):
+    """
+    Locate open reading frames in a translated frame.
+
+    Arguments:
+    - protein    - translation of a frame, required (bytes)
+    - min_length - shortest ORF kept, in amino acids (int)
+    - met        - start ORFs at their first methionine instead of right
+                   after the previous stop codon (bool)
+
+    Return the (start, end) amino acid offsets of the ORFs, stop codons
+    excluded. The ends of the frame count as stops, so ORFs of partial
+    transcripts are kept: the first ORF of a frame starts at the start of
+    the frame even with met, its start codon may lie before the contig.
+    """
+    orfs = []
+    start = 0
+    for stretch in protein.split(b"*"):
+        end = start + len(stretch)
+        if len(stretch) >= min_length and met and start:
+            first = protein.find(b"M", start, end)
+            if first >= 0 and end - first >= min_length:
+                orfs.append((first, end))
+        elif len(stretch) >= min_length:
+            orfs.append((start, end))
+        start = end + 1
+
+    return orfs
+
+
+def translate_orfs(records, min_length=MIN_ORF, met=False, sw=60):
+    """
+    Translate (name, seq) records in six frames and keep their ORFs.
+
+    Arguments:
+    - records    - DNA records, required (iterable of (name, seq))
+    - min_length - shortest ORF kept, in amino acids (int)
+    - met        - Met-to-stop rather than stop-to-stop ORFs (bool)
+    - sw         - line width of the protein fasta text (int)
+
+    Return the FASTA text as bytes and the ORF ids. ORFs are named
+    {name}_frame={frame}_orf={first}-{last}, with the 1-based positions on
+    the contig of their first and last nucleotides, stop codon excluded;
+    first is lower than last on both strands.
+    """
+    chunks = []
+    seqids = []
+    for name, seq in records:
+        length = len(seq)
+        for idx, frame in enumerate(six_frames(seq)):
+            offset = idx % 3
+            for start, end in find_orfs(frame, min_length, met):
+                if idx < 3:
+                    first, last = offset + 3 * start + 1, offset + 3 * end
+                else:
+                    first = length - offset - 3 * end + 1
+                    last = length - offset - 3 * start
+                seqid = f"{name}_frame={idx + 1}_orf={first}-{last}"
+                seqids.append(seqid)
+                chunks.append(
+                    b">%s\n%s\n"
+                    % (seqid.encode("utf-8"), wrap(frame[start:end], sw))
+                )
+
+    return b"".join(chunks), seqids
@@ -0,0 +1,280 @@
+"""Streaming upload of input files to a per-job directory."""
+from alphabet import AlphabetCounter, classify, WHITESPACE
+from batch import is_archive
+from flask import current_app, Request
+import hashlib
+import os
+import shutil
+import tempfile
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+import zlib
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+# Records longer than this are counted piece by piece instead of joined
+RECORD_BLOCK = 1 << 20
+
+
+class UploadError(BadRequest):
+    """
+    Upload rejected while it was received.
+
+    A BadRequest rather than a ValueError, which Werkzeug form parsing
+    silently turns into an empty form.
+    """
+
+
+def normalize(seq):
+    """
+    Sequence as hashed in input digests: upper case, without whitespace.
+    """
+    return seq.upper().translate(None, WHITESPACE)
+
+
+def records_digest(records):
+    """
+    sha256 of (name, sequence) records as FastaValidator.digest, for inputs
+    that do not go through an upload.
+    """
+    digest = hashlib.sha256()
+    for name, seq in records:
+        if isinstance(name, str):
+            name = name.encode("utf-8")
+        digest.update(b">%s\n%s\n" % (name, normalize(seq)))
+
+    return digest.hexdigest()
+
+
+class FastaValidator(object):
+    """
+    Check fasta text fed in chunks: a header before any sequence, and
+    every record DNA or every record protein.
+
+    The digest of the records, first word of headers and normalized
+    sequences, is the same whatever the compression and line width.
+    """
+
+    def __init__(self):
+        self.tail = b""
+        self.records = 0
+        self.stype = None
+        # Sequence of the current record, None before the first header
+        self.seq = None
+        self.seqsize = 0
+        self.counter = None
+        self.digest = hashlib.sha256()
+
+    def feed(self, data):
+        # Complete lines only, split on headers so that sequence lines of a
+        # record are counted in one go
+        text, newline, self.tail = (self.tail + data).rpartition(b"\n")
+        text += newline
+        if not text:
+            return
+        first, *records = (b"\n" + text).split(b"\n>")
+        self._sequence(first)
+        for record in records:
+            header, _, seq = record.partition(b"\n")
+            self._record()
+            if not header.strip():
+                raise UploadError(f"Record {self.records + 1} has no name.")
+            self.digest.update(b">%s\n" % header.split(None, 1)[0])
+            self.seq, self.seqsize, self.counter = [], 0, None
+            self._sequence(seq)
+
+    def _sequence(self, seq):
+        if self.seq is None:
+            if seq.strip():
+                raise UploadError("Provided file is not a fasta file.")
+            return
+        self.seq.append(seq)
+        self.seqsize += len(seq)
+        if self.seqsize > RECORD_BLOCK:
+            self.counter = self.counter or AlphabetCounter()
+            seq = b"".join(self.seq)
+            self.counter.update(seq)
+            self.digest.update(normalize(seq))
+            self.seq, self.seqsize = [], 0
+
+    def _record(self):
+        if self.seq is None:
+            return
+        self.records += 1
+        seq = b"".join(self.seq)
+        self.digest.update(normalize(seq) + b"\n")
+        if self.counter is None:
+            stype, _ = classify(seq)
+        else:
+            self.counter.update(seq)
+            stype, _ = self.counter.classify()
+        if stype == "unknown":
+            raise UploadError(
+                f"Record {self.records} is not DNA nor proteins."
+            )
+        if self.stype is not None and stype != self.stype:
+            raise UploadError("Provided file mixes DNA and proteins.")
+        self.stype = stype
+
+    def close(self):
+        """
+        Check the last record. Raise UploadError when no record was found.
+        """
+        self.feed(b"\n")
+        self._record()
+        self.seq = self.counter = None
+        if not self.records:
+            raise UploadError("Provided file has no sequence.")
+
+
+class StreamingUpload(object):
+    """
+    Writable file object given to Werkzeug for an uploaded file.
+
+    Arguments:
+    - path     - file where chunks are written as they arrive, required
+    - max_size - maximum size in bytes, after decompression for gzip
+                 files, required (int)
+    - validate - check fasta format and alphabet on the fly (bool)
+
+    Chunks are hashed as they are written; sha256 is the hex digest of the
+    uploaded bytes. Gzipped files are decompressed on the fly for
+    validation only, the file is stored as uploaded.
+    """
+
+    def __init__(self, path, max_size, validate=True):
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        self.expanded = 0
+        self.hash = hashlib.sha256()
+        self.validator = FastaValidator() if validate else None
+        self.inflate = None
+        self.fh = open(path, "w+b")
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge(
+                f"Uploads are limited to {self.max_size} bytes."
+            )
+        self.hash.update(data)
+        if self.validator is not None:
+            self._validate(data)
+
+        return self.fh.write(data)
+
+    def _validate(self, data):
+        if self.size == len(data) and data[:2] == GZIP_MAGIC:
+            self.inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.inflate is None:
+            self.validator.feed(data)
+            return
+        while data:
+            text = self.inflate.decompress(data)
+            self.expanded += len(text)
+            if self.expanded > self.max_size:
+                raise RequestEntityTooLarge(
+                    f"Uploads are limited to {self.max_size} bytes"
+                    + " once decompressed."
+                )
+            self.validator.feed(text)
+            # Concatenated gzip members, as written by bgzip
+            data = self.inflate.unused_data
+            if data and self.inflate.eof:
+                self.inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                data = b""
+
+    @property
+    def sha256(self):
+        return self.hash.hexdigest()
+
+    @property
+    def digest(self):
+        """
+        Digest of the normalized records, None when not validated.
+        """
+        if self.validator is None:
+            return None
+        return self.validator.digest.hexdigest()
+
+    def finish(self):
+        """
+        Validate the end of the file.
+        """
+        if self.validator is not None:
+            self.validator.close()
+
+    def __getattr__(self, name):
+        # seek, read, close and friends of the underlying file
+        return getattr(self.fh, name)
+
+
+class UploadRequest(Request):
+    """
+    Flask request streaming uploaded files to a directory of their own.
+
+    Every request with files gets a fresh directory under UPLOAD_FOLDER,
+    so concurrent users never share a path. It is removed at the end of
+    the request unless keep_upload is called.
+    """
+
+    upload_dir = None
+    upload_kept = False
+
+    def make_upload_dir(self):
+        if self.upload_dir is None:
+            os.makedirs(current_app.config["UPLOAD_FOLDER"], exist_ok=True)
+            self.upload_dir = tempfile.mkdtemp(
+                dir=current_app.config["UPLOAD_FOLDER"]
+            )
+
+        return self.upload_dir
+
+    def _get_file_stream(
+        self,
+        total_content_length,
+        content_type,
+        filename=None,
+        content_length=None,
+    ):
+        name = secure_filename(filename or "") or "upload"
+        path = os.path.join(self.make_upload_dir(), name)
+        count = 1
+        while os.path.exists(path):
+            path = os.path.join(self.upload_dir, f"{count}_{name}")
+            count += 1
+
+        # Anything but an archive is checked as fasta whatever its name,
+        # gzip files being told by their magic number
+        return StreamingUpload(
+            path,
+            current_app.config["UPLOAD_MAX_SIZE"],
+            validate=not is_archive(filename or ""),
+        )
+
+    def keep_upload(self):
+        """
+        Keep the upload directory once the request is over.
+        """
+        self.upload_kept = True
+
+    def discard_upload(self):
+        """
+        Remove the upload directory unless kept.
+        """
+        if self.upload_dir is not None and not self.upload_kept:
+            shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+
+def uploaded(file):
+    """
+    Path, sha256 and records digest of an uploaded file, after checking its
+    last record.
+    """
+    upload = file.stream
+    upload.finish()
+    upload.close()
+
+    return upload.path, upload.sha256, upload.digest
@@ -2,14 +2,25 @@ import os
 
 import redis
 from rq import Worker, Queue, Connection
+from runtime import init_context, preload
+from scheduler import QUEUES
+import sys
 
-listen = ["default"]
+listen = QUEUES
 
 redis_url = os.getenv("REDISTOGO_URL", "redis://localhost:6379")
 
 redis_conn = redis.from_url(redis_url)
 
 if __name__ == "__main__":
+    # Queue names may be given on the command line, e.g. a fast lane only
+    # worker with: python worker.py fast
+    listen = sys.argv[1:] or listen
+    # Probe tools, check databases and import the analysis stack once, jobs
+    # inherit them when forked
+    init_context()
+    preload()
     with Connection(redis_conn):
         worker = Worker(list(map(Queue, listen)))
-        worker.work()
+        # The scheduler queues failed jobs again once their retry is due
+        worker.work(with_scheduler=True)